@@ -1,14 +1,121 @@
 import urllib.parse
 import re
-from apple_music_importer.session import UnauthorizedRequestException
+import requests
+from enum import Enum
+from apple_music_importer.api.matcher import (
+    MIN_CONFIDENCE,
+    STRONG_CONFIDENCE,
+    rank_candidates,
+)
+from apple_music_importer.api.query_planner import QueryPlanner
+from apple_music_importer.cache import MISS
+from apple_music_importer.concurrency import map_in_order, prompt_lock
+from apple_music_importer.session import (
+    RateLimitExceededException,
+    UnauthorizedRequestException,
+)
+
+# Maximum number of ISRCs accepted by a single filter[isrc] request
+ISRC_BATCH_SIZE = 25
+# Number of songs sent per library add request (IDs go in the query string)
+LIBRARY_ADD_BATCH_SIZE = 100
+# Number of songs sent per playlist create/add request body
+PLAYLIST_BATCH_SIZE = 100
+# Number of library songs fetched per page
+LIBRARY_PAGE_SIZE = 100
+
+
+# Song attributes kept in the track list (used by sync, merging and matching)
+SLIM_SONG_ATTRIBUTES = (
+    "albumName",
+    "artistName",
+    "durationInMillis",
+    "isrc",
+    "name",
+    "url",
+)
+
+
+def slim_song(song: dict) -> dict:
+    """
+    Return the parts of a catalog song resource that are stored in the
+    track list, keeping its match_type and confidence.
+
+    Accepts both plain resources and the older {"response": resource} shape.
+    """
+    resource = song.get("response", song)
+    attributes = resource.get("attributes", {})
+    slim = {
+        "id": resource.get("id"),
+        "type": resource.get("type", "songs"),
+        "attributes": {
+            key: attributes[key] for key in SLIM_SONG_ATTRIBUTES if key in attributes
+        },
+    }
+    for key in ("match_type", "confidence"):
+        value = song.get(key, resource.get(key))
+        if value is not None:
+            slim[key] = value
+    return slim
+
+
+class SearchProfile(str, Enum):
+    lean = "lean"
+    full = "full"
+
+
+# Query parameters of each search profile (limit and term are added per request)
+SEARCH_PROFILES = {
+    # Songs only, with just the attributes used for matching and syncing
+    SearchProfile.lean: {
+        "fields[songs]": "albumName,artistName,durationInMillis,isrc,name,playParams,url",
+        "format[resources]": "map",
+        "omit[resource]": "autos",
+        "platform": "web",
+        "types": "songs",
+    },
+    # Everything the Apple Music web client requests
+    SearchProfile.full: {
+        "art[music-videos:url]": "c",
+        "art[url]": "f",
+        "extend": "artistUrl",
+        "fields[albums]": "artistName,artistUrl,name,playParams,releaseDate,url",
+        "fields[artists]": "url,name",
+        "format[resources]": "map",
+        "include[albums]": "artists",
+        "include[music-videos]": "artists",
+        "include[songs]": "artists",
+        "include[stations]": "radio-show",
+        "omit[resource]": "autos",
+        "platform": "web",
+        "relate[albums]": "artists",
+        "relate[songs]": "albums",
+        "types": "activities,albums,apple-curators,artists,curators,editorial-items,music-movies,music-videos,playlists,record-labels,songs,stations,tv-episodes,uploaded-videos",
+        "with": "lyricHighlights,lyrics,naturalLanguage,serverBubbles,subtitles",
+    },
+}
 
 
 class AppleMusicAPI:
-    def __init__(self, session_handler, country_code, limit=1):
+    def __init__(
+        self,
+        session_handler,
+        country_code,
+        limit=1,
+        cache=None,
+        search_profile=SearchProfile.lean,
+        planner=None,
+        speculative=False,
+        base_url="https://amp-api.music.apple.com",
+    ):
         self.session_handler = session_handler
         self.country_code = country_code
         self.limit = limit
-        self.base_url = f"https://amp-api.music.apple.com"
+        self.cache = cache
+        self.search_profile = SearchProfile(search_profile)
+        self.planner = planner or QueryPlanner()
+        self.speculative = speculative
+        self.base_url = base_url
         self.catalog_base_url = f"{self.base_url}/v1/catalog/{country_code}"
 
     def add_tracks_to_library(self, music_id_list):
@@ -41,70 +148,182 @@ class AppleMusicAPI:
         response_json = self.session_handler.post(url, data)
         return response_json
 
-    def get_my_library(self):
-        url = f"{self.base_url}/me/library/songs"
-        all_songs = []
-        while True:
-            queries = {
-                "format[resources]": "map",
-                "include[library-songs]": "catalog",
-                "limit": "100",
-                "meta": "sorts",
-                "platform": "web",
-                "sort": "name",
-            }
-            if "?" in url:
-                url = f"{url}&{urllib.parse.urlencode(queries, quote_via=urllib.parse.quote)}"
-            else:
-                url = f"{url}?{urllib.parse.urlencode(queries, quote_via=urllib.parse.quote)}"
-            response_json = self.session_handler.get(url)
-            all_songs.extend(response_json.get("data", []))
-            next_url = response_json.get("next")
-            if not next_url:
+    def add_tracks_to_playlist(self, playlist_id, music_id_list):
+        url = f"{self.base_url}/v1/me/library/playlists/{playlist_id}/tracks"
+        data = {
+            "data": [{"id": music_id, "type": "songs"} for music_id in music_id_list]
+        }
+        response_json = self.session_handler.post(url, data)
+        return response_json
+
+    def delete_library_song(self, library_song_id):
+        url = f"{self.base_url}/v1/me/library/songs/{library_song_id}"
+        try:
+            return self.session_handler.delete(url)
+        except requests.HTTPError as e:
+            # Already deleted, e.g. by an interrupted earlier run
+            if e.response is not None and e.response.status_code == 404:
+                return None
+            raise
+
+    def _get_library_songs_page(self, offset):
+        queries = {
+            "include[library-songs]": "catalog",
+            "limit": LIBRARY_PAGE_SIZE,
+            "offset": offset,
+            "platform": "web",
+            "sort": "-dateAdded",
+        }
+        query = urllib.parse.urlencode(queries, quote_via=urllib.parse.quote)
+        url = f"{self.base_url}/v1/me/library/songs?{query}"
+        return self.session_handler.get(url)
+
+    def get_my_library(self, known_ids=None, workers=1):
+        """
+        Fetch the songs in the library, most recently added first.
+
+        If known_ids (library song IDs from an earlier snapshot) is given,
+        pages are fetched one at a time until a page contains a known song.
+        Otherwise the pages after the first are fetched concurrently using
+        the total reported with the first page.
+        """
+        response_json = self._get_library_songs_page(0)
+        all_songs = list(response_json.get("data", []))
+        total = response_json.get("meta", {}).get("total")
+
+        if known_ids is None and total is not None:
+            offsets = range(LIBRARY_PAGE_SIZE, total, LIBRARY_PAGE_SIZE)
+            for _, page in map_in_order(
+                self._get_library_songs_page, offsets, workers
+            ):
+                all_songs.extend(page.get("data", []))
+            return all_songs
+
+        known_ids = known_ids or set()
+        while response_json.get("next") and response_json.get("data"):
+            if any(song["id"] in known_ids for song in response_json["data"]):
                 break
-            url = next_url
+            response_json = self._get_library_songs_page(len(all_songs))
+            all_songs.extend(response_json.get("data", []))
         return all_songs
 
+    def _cached_get(self, endpoint, query, fetch):
+        """Return the response for a catalog query, consulting the cache first."""
+        if self.cache is None:
+            return fetch()
+        response = self.cache.get(self.country_code, endpoint, query)
+        self.session_handler.metrics.record_cache(response is not MISS)
+        if response is MISS:
+            response = fetch()
+            self.cache.set(self.country_code, endpoint, query, response)
+        return response
+
     def search_track_by_isrc(self, isrc):
-        queries = {"filter[isrc]": isrc}
-        query = urllib.parse.urlencode(queries, quote_via=urllib.parse.quote)
+        song = self.search_tracks_by_isrcs([isrc]).get(isrc.upper())
+        if song is None:
+            print(f"Track with ISRC {isrc} not found.")
+        return song
+
+    def _fetch_isrc_batch(self, isrcs):
+        """Fetch catalog songs for a batch of ISRCs, grouped by ISRC."""
+        queries = {"filter[isrc]": ",".join(isrcs)}
+        query = urllib.parse.urlencode(queries, quote_via=urllib.parse.quote, safe=",")
         url = f"{self.catalog_base_url}/songs?{query}"
         response_json = self.session_handler.get(url)
-        try:
-            return response_json.get("data", [])[0].get("attributes", {}).values()
-        except IndexError:
-            print(f"Track with ISRC {isrc} not found.")
-            return None
+        songs_by_isrc = {isrc: [] for isrc in isrcs}
+        for song in response_json.get("data", []):
+            isrc = song.get("attributes", {}).get("isrc", "").upper()
+            if isrc in songs_by_isrc:
+                songs_by_isrc[isrc].append(song)
+        return songs_by_isrc
+
+    def search_tracks_by_isrcs(self, isrcs, workers=1):
+        """
+        Resolve ISRCs to catalog songs using as few requests as possible.
+
+        Returns a dictionary mapping each found ISRC (upper case) to the first
+        matching song resource; ISRCs without a match are left out.
+        """
+        found = {}
+        pending = []
+        for isrc in dict.fromkeys(isrc.upper() for isrc in isrcs if isrc):
+            cached = (
+                MISS
+                if self.cache is None
+                else self.cache.get(self.country_code, "songs?filter[isrc]", isrc)
+            )
+            if self.cache is not None:
+                self.session_handler.metrics.record_cache(cached is not MISS)
+            if cached is MISS:
+                pending.append(isrc)
+            elif cached:
+                found[isrc] = cached[0]
+
+        batches = [
+            pending[start : start + ISRC_BATCH_SIZE]
+            for start in range(0, len(pending), ISRC_BATCH_SIZE)
+        ]
+        for _, songs_by_isrc in map_in_order(self._fetch_isrc_batch, batches, workers):
+            for isrc, songs in songs_by_isrc.items():
+                if self.cache is not None:
+                    self.cache.set(self.country_code, "songs?filter[isrc]", isrc, songs)
+                if songs:
+                    found[isrc] = songs[0]
+        return found
 
     def _search_by_term(self, term):
         """Execute a search request to the Apple Music API."""
         queries = {
-            "art[music-videos:url]": "c",
-            "art[url]": "f",
-            "extend": "artistUrl",
-            "fields[albums]": "artistName,artistUrl,name,playParams,releaseDate,url",
-            "fields[artists]": "url,name",
-            "format[resources]": "map",
-            "include[albums]": "artists",
-            "include[music-videos]": "artists",
-            "include[songs]": "artists",
-            "include[stations]": "radio-show",
+            **SEARCH_PROFILES[self.search_profile],
             "limit": self.limit,
-            "omit[resource]": "autos",
-            "platform": "web",
-            "relate[albums]": "artists",
-            "relate[songs]": "albums",
             "term": term,
-            "types": "activities,albums,apple-curators,artists,curators,editorial-items,music-movies,music-videos,playlists,record-labels,songs,stations,tv-episodes,uploaded-videos",
-            "with": "lyricHighlights,lyrics,naturalLanguage,serverBubbles,subtitles",
         }
         query = urllib.parse.urlencode(queries, quote_via=urllib.parse.quote)
         url = f"{self.catalog_base_url}/search?{query}"
-        response_json = self.session_handler.get(url)
-        return response_json.get("resources", {}).get("songs", {}).values()
+        return self._cached_get(
+            f"search?profile={self.search_profile.value}&limit={self.limit}",
+            term,
+            lambda: list(
+                self.session_handler.get(url)
+                .get("resources", {})
+                .get("songs", {})
+                .values()
+            ),
+        )
+
+    def _search_planned(self, planned):
+        """
+        Yield (query, match_type, results) for each planned query in order.
+
+        In speculative mode every query is sent at once and the results are
+        still consumed in priority order; otherwise each query is only sent
+        when the previous ones produced no match.
+        """
+        workers = len(planned) if self.speculative else 1
+        for (query, match_type), results in map_in_order(
+            lambda pattern: self._search_by_term(pattern[0]), planned, workers
+        ):
+            yield query, match_type, results
 
-    def search_track_from_text(self, title, artist, album, require_confirm):
-        """Search for a track on Apple Music."""
+    def search_track_from_text(
+        self,
+        title,
+        artist,
+        album,
+        require_confirm,
+        source=None,
+        duration_ms=None,
+        return_weak=False,
+    ):
+        """
+        Search for a track on Apple Music.
+
+        Every candidate returned by a query is ranked against the track, and
+        the remaining queries are only sent while no candidate is a strong
+        match. The best candidate is returned with its match_type and
+        confidence; a weak best candidate needs confirmation, unless
+        return_weak is set to leave the decision to the caller.
+        """
         title_without_supplement = re.sub(
             r"\s(feat.*|((（|\()(?!.*\b(?:instrumental)\b.*$).*?(instrumental)?.*?(）|\))))",
             r" \4",
@@ -131,33 +350,50 @@ class AppleMusicAPI:
             (title_without_supplement_and_symbols, "title"),
         ]
 
+        best_score, best, best_match_type = 0.0, None, None
         try:
-            for query, match_type in query_patterns:
-                results = self._search_by_term(query)
-                for result in results:
-                    if match_type == "title" and not self._check_artist_name(
-                        title, album, artist, result, require_confirm
-                    ):
-                        continue
-                    result["match_type"] = match_type
-                    return result
-            return None
-        except UnauthorizedRequestException:
+            planned = self.planner.plan(query_patterns, source)
+            for _, match_type, results in self._search_planned(planned):
+                ranked = rank_candidates(title, artist, album, duration_ms, results)
+                if ranked and ranked[0][0] > best_score:
+                    (best_score, best), best_match_type = ranked[0], match_type
+                if best_score >= STRONG_CONFIDENCE:
+                    break
+        except (UnauthorizedRequestException, RateLimitExceededException):
             raise
         except Exception as e:
             print(f"Error searching for {title} by {artist}: {e}")
             return None
 
-    def _check_artist_name(self, title, artist, album, result, require_confirm=False):
-        """Check if the artist name matches in the result."""
+        if best is None:
+            return None
         if (
-            artist.lower() not in result["attributes"]["artistName"].lower()
-            and require_confirm
+            best_score < MIN_CONFIDENCE
+            and not return_weak
+            and not self._confirm_candidate(
+                title, artist, album, best, best_score, require_confirm
+            )
         ):
+            return None
+        self.planner.record(source, best_match_type)
+        return {
+            **slim_song(best),
+            "match_type": best_match_type,
+            "confidence": round(best_score, 3),
+        }
+
+    def _confirm_candidate(
+        self, title, artist, album, result, score, require_confirm=False
+    ):
+        """Ask whether a weak candidate should be used (rejected if not confirming)."""
+        if not require_confirm:
+            return False
+        attributes = result["attributes"]
+        with prompt_lock:
             user_input = input(
-                f"Artist name mismatch: {artist} vs {result['attributes']['artistName']}.\n"
-                f"Title: {title} / {result['attributes']['name']}\n"
-                f"Album: {album} / {result['attributes']['albumName']}\nDo you want to add it? (Y/n): "
+                f"Weak match (confidence {score:.2f}):\n"
+                f"Artist: {artist} / {attributes.get('artistName')}\n"
+                f"Title: {title} / {attributes.get('name')}\n"
+                f"Album: {album} / {attributes.get('albumName')}\nDo you want to add it? (Y/n): "
             ).lower()
-            return user_input == "y"
-        return False
+        return user_input == "y"
@@ -0,0 +1,89 @@
+from difflib import SequenceMatcher
+from apple_music_importer.utils import normalize_text
+
+# A candidate scoring at least this is accepted without sending further queries
+STRONG_CONFIDENCE = 0.9
+# Candidates scoring below this are only accepted after confirmation
+MIN_CONFIDENCE = 0.7
+
+# Similarity of a text whose words all appear in the other one; below
+# STRONG_CONFIDENCE so that such a match alone never ends the search
+CONTAINED_SIMILARITY = 0.8
+
+# Relative weight of each field; fields unknown on either side are left out
+WEIGHTS = {"title": 0.45, "artist": 0.3, "album": 0.1, "duration": 0.15}
+# Durations closer than this are a full match, and this far apart no match
+DURATION_TOLERANCE_MS = 3_000
+DURATION_MISMATCH_MS = 30_000
+
+
+def _contains_words(short: str, long: str) -> bool:
+    """Check whether the words of short appear consecutively in long."""
+    short_words, long_words = short.split(), long.split()
+    if not short_words or len(short_words) > len(long_words):
+        return False
+    return any(
+        long_words[i : i + len(short_words)] == short_words
+        for i in range(len(long_words) - len(short_words) + 1)
+    )
+
+
+def text_similarity(a: str, b: str) -> float:
+    """Return the similarity of two normalized strings between 0 and 1."""
+    if not a or not b:
+        return 0.0
+    if a == b:
+        return 1.0
+    ratio = SequenceMatcher(None, a, b).ratio()
+    # e.g. "Artist" vs "Artist & Other Artist", "Title" vs "Title (Remastered)"
+    if _contains_words(a, b) or _contains_words(b, a):
+        ratio = max(ratio, CONTAINED_SIMILARITY)
+    return ratio
+
+
+def duration_similarity(a: int, b: int) -> float:
+    difference = abs(a - b)
+    if difference <= DURATION_TOLERANCE_MS:
+        return 1.0
+    if difference >= DURATION_MISMATCH_MS:
+        return 0.0
+    return 1 - (difference - DURATION_TOLERANCE_MS) / (
+        DURATION_MISMATCH_MS - DURATION_TOLERANCE_MS
+    )
+
+
+def score_candidate(title, artist, album, duration_ms, candidate) -> float:
+    """
+    Score how well a catalog song matches a track, between 0 and 1.
+
+    The title, artist, album and duration similarities are combined by
+    WEIGHTS, normalized over the fields known on both sides.
+    """
+    attributes = candidate.get("attributes", {})
+    scores = {
+        "title": text_similarity(
+            normalize_text(title), normalize_text(attributes.get("name"))
+        ),
+        "artist": text_similarity(
+            normalize_text(artist), normalize_text(attributes.get("artistName"))
+        ),
+    }
+    if album and attributes.get("albumName"):
+        scores["album"] = text_similarity(
+            normalize_text(album), normalize_text(attributes["albumName"])
+        )
+    if duration_ms and attributes.get("durationInMillis"):
+        scores["duration"] = duration_similarity(
+            int(duration_ms), attributes["durationInMillis"]
+        )
+    total_weight = sum(WEIGHTS[field] for field in scores)
+    return sum(WEIGHTS[field] * score for field, score in scores.items()) / total_weight
+
+
+def rank_candidates(title, artist, album, duration_ms, candidates) -> list:
+    """Return (score, candidate) pairs, best first; ties keep the API's order."""
+    scored = [
+        (score_candidate(title, artist, album, duration_ms, candidate), candidate)
+        for candidate in candidates
+    ]
+    return sorted(scored, key=lambda pair: pair[0], reverse=True)
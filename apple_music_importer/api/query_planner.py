@@ -0,0 +1,56 @@
+import threading
+from collections import Counter, defaultdict
+
+# Match type of the title-only pattern, which is always tried last
+FALLBACK_MATCH_TYPE = "title"
+
+
+class QueryPlanner:
+    """
+    Decide which search queries are sent for a track, and in which order.
+
+    Query strings that normalize to one already planned are dropped. In
+    adaptive mode, the patterns are reordered per source (e.g. "local" or
+    "spotify") by how often each one produced the match so far in the run.
+    """
+
+    def __init__(self, adaptive=False, warmup=20):
+        self.adaptive = adaptive
+        self.warmup = warmup
+        self.hits = defaultdict(Counter)
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _normalize_query(query):
+        return " ".join(query.lower().split())
+
+    def plan(self, query_patterns, source=None):
+        """Return the (query, match_type) pairs to send, in order."""
+        seen = set()
+        planned = []
+        for query, match_type in query_patterns:
+            key = self._normalize_query(query)
+            if key and key not in seen:
+                seen.add(key)
+                planned.append((query, match_type))
+
+        if not self.adaptive or source is None:
+            return planned
+        with self.lock:
+            hits = dict(self.hits[source])
+        if sum(hits.values()) < self.warmup:
+            return planned
+        return sorted(
+            planned,
+            key=lambda pattern: (
+                pattern[1] == FALLBACK_MATCH_TYPE,
+                -hits.get(pattern[1], 0),
+            ),
+        )
+
+    def record(self, source, match_type):
+        """Record which pattern produced the match for a track from source."""
+        if source is None:
+            return
+        with self.lock:
+            self.hits[source][match_type] += 1
@@ -1,13 +1,23 @@
 import spotipy
 from spotipy.oauth2 import SpotifyOAuth
+from apple_music_importer.concurrency import map_in_order
 from apple_music_importer.utils import normalize
 
 scope = "user-library-read"
 
+# Maximum page sizes accepted by the playlist and saved tracks endpoints
+PLAYLIST_PAGE_SIZE = 100
+SAVED_TRACKS_PAGE_SIZE = 50
+# Only the fields used by _organize_playlist_tracks
+PLAYLIST_FIELDS = (
+    "total,items(added_at,track(id,name,artists(name),album(name),duration_ms,"
+    "external_urls(spotify),external_ids(isrc)))"
+)
+
 
 class SpotifyAPI:
-    def __init__(self):
-        self.client = spotipy.Spotify(auth_manager=SpotifyOAuth(scope=scope))
+    def __init__(self, client=None):
+        self.client = client or spotipy.Spotify(auth_manager=SpotifyOAuth(scope=scope))
 
     def _organize_playlist_tracks(self, tracks):
         return [
@@ -19,21 +29,71 @@ class SpotifyAPI:
                 "url": track["track"]["external_urls"]["spotify"],
                 "date_added": track["added_at"],
                 "isrc": track["track"]["external_ids"]["isrc"].upper(),
+                "duration_ms": track["track"].get("duration_ms"),
             }
             for track in tracks
         ]
 
-    def get_playlist_tracks(self, playlist: str):
-        tracks = []
-        offset = 0
-        while True:
-            response = (
-                self.client.playlist_tracks(playlist, offset=offset)
-                if playlist != "liked"
-                else self.client.current_user_saved_tracks(offset=offset)
+    def _get_page(self, playlist: str, offset: int):
+        if playlist == "liked":
+            return self.client.current_user_saved_tracks(
+                limit=SAVED_TRACKS_PAGE_SIZE, offset=offset
             )
+        return self.client.playlist_tracks(
+            playlist, fields=PLAYLIST_FIELDS, limit=PLAYLIST_PAGE_SIZE, offset=offset
+        )
+
+    def get_playlist_tracks(self, playlist: str, workers: int = 1):
+        """Fetch all tracks of a playlist, requesting pages after the first concurrently."""
+        page_size = SAVED_TRACKS_PAGE_SIZE if playlist == "liked" else PLAYLIST_PAGE_SIZE
+        response = self._get_page(playlist, 0)
+        tracks = list(response["items"])
+        offsets = range(page_size, response["total"], page_size)
+        for _, response in map_in_order(
+            lambda offset: self._get_page(playlist, offset), offsets, workers
+        ):
             tracks.extend(response["items"])
-            if response["next"] is None:
-                break
-            offset += response["limit"]
+        return self._organize_playlist_tracks(tracks)
+
+    def get_snapshot_id(self, playlist: str):
+        """Return the snapshot ID of a playlist (None for liked songs)."""
+        if playlist == "liked":
+            return None
+        return self.client.playlist(playlist, fields="snapshot_id")["snapshot_id"]
+
+    def get_tracks_added_since(self, playlist: str, added_at: str):
+        """
+        Fetch only the tracks added after the given timestamp.
+
+        Liked songs are returned newest first, so pages are read from the
+        start; playlist tracks are appended at the end, so pages are read
+        from the end backwards. Paging stops at the first older track;
+        tracks without a timestamp (old playlist entries) count as older.
+        """
+        tracks = []
+        if playlist == "liked":
+            offset = 0
+            while True:
+                response = self._get_page(playlist, offset)
+                new_items = [
+                    i for i in response["items"] if (i["added_at"] or "") > added_at
+                ]
+                tracks.extend(new_items)
+                offset += SAVED_TRACKS_PAGE_SIZE
+                if len(new_items) < len(response["items"]) or response["next"] is None:
+                    break
+        else:
+            total = self.client.playlist_tracks(playlist, fields="total", limit=1)[
+                "total"
+            ]
+            offset = (max(total - 1, 0) // PLAYLIST_PAGE_SIZE) * PLAYLIST_PAGE_SIZE
+            while offset >= 0:
+                response = self._get_page(playlist, offset)
+                new_items = [
+                    i for i in response["items"] if (i["added_at"] or "") > added_at
+                ]
+                tracks[:0] = new_items
+                offset -= PLAYLIST_PAGE_SIZE
+                if len(new_items) < len(response["items"]):
+                    break
         return self._organize_playlist_tracks(tracks)
@@ -0,0 +1,121 @@
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from apple_music_importer.utils import normalize
+
+# Returned by ResponseCache.get on a miss, since None is a valid cached value
+MISS = object()
+
+
+class ResponseCache:
+    """
+    Persistent SQLite cache for Apple Music catalog responses.
+
+    Entries are keyed by storefront, endpoint and normalized query, expire
+    after `ttl` seconds and are evicted least-recently-used first once the
+    cache holds more than `max_entries` rows.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        ttl: float = 30 * 24 * 60 * 60,
+        max_entries: int = 200_000,
+        refresh: bool = False,
+    ):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.refresh = refresh
+        self.lock = threading.Lock()
+        self.writes = 0
+        self.connection = sqlite3.connect(
+            str(path), check_same_thread=False, isolation_level=None
+        )
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                storefront TEXT NOT NULL,
+                endpoint TEXT NOT NULL,
+                query TEXT NOT NULL,
+                response TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL,
+                PRIMARY KEY (storefront, endpoint, query)
+            )
+            """
+        )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)"
+        )
+        # Short runs may never reach the periodic eviction in set()
+        with self.lock:
+            self._evict()
+
+    @staticmethod
+    def normalize_query(query: str) -> str:
+        """Normalize a query so trivially different spellings share an entry."""
+        return " ".join(normalize(query).lower().split())
+
+    def get(self, storefront: str, endpoint: str, query: str):
+        """Return the cached response, or MISS if absent, expired or refreshing."""
+        if self.refresh:
+            return MISS
+        key = (storefront, endpoint, self.normalize_query(query))
+        now = time.time()
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT response, created_at FROM responses "
+                "WHERE storefront = ? AND endpoint = ? AND query = ?",
+                key,
+            ).fetchone()
+            if row is None:
+                return MISS
+            if now - row[1] > self.ttl:
+                self.connection.execute(
+                    "DELETE FROM responses "
+                    "WHERE storefront = ? AND endpoint = ? AND query = ?",
+                    key,
+                )
+                return MISS
+            self.connection.execute(
+                "UPDATE responses SET accessed_at = ? "
+                "WHERE storefront = ? AND endpoint = ? AND query = ?",
+                (now, *key),
+            )
+        return json.loads(row[0])
+
+    def set(self, storefront: str, endpoint: str, query: str, response) -> None:
+        """Store a response, evicting the least recently used entries if full."""
+        now = time.time()
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    storefront,
+                    endpoint,
+                    self.normalize_query(query),
+                    json.dumps(response, ensure_ascii=False),
+                    now,
+                    now,
+                ),
+            )
+            self.writes += 1
+            if self.writes % 1000 == 0:
+                self._evict()
+
+    def _evict(self) -> None:
+        (count,) = self.connection.execute("SELECT COUNT(*) FROM responses").fetchone()
+        if count > self.max_entries:
+            self.connection.execute(
+                "DELETE FROM responses WHERE rowid IN ("
+                "SELECT rowid FROM responses ORDER BY accessed_at LIMIT ?)",
+                (count - self.max_entries,),
+            )
+
+    def close(self) -> None:
+        with self.lock:
+            self._evict()
+            self.connection.close()
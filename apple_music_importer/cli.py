@@ -2,9 +2,14 @@ from pathlib import Path
 from typing import Optional
 import typer
 from typing_extensions import Annotated
+from apple_music_importer.api.apple_music import SearchProfile
 from apple_music_importer.commands.local import local
+from apple_music_importer.commands.migrate import migrate
+from apple_music_importer.commands.review import review
 from apple_music_importer.commands.spotify import spotify
 from apple_music_importer.commands.sync import sync
+from apple_music_importer.commands.work import work
+from apple_music_importer.metrics import Metrics
 
 
 app = typer.Typer(
@@ -14,22 +19,24 @@ app = typer.Typer(
 app.command()(local)
 app.command()(spotify)
 app.command()(sync)
+app.command()(review)
+app.command()(migrate)
+app.command()(work)
 
 
 @app.callback()
 def callback(
     ctx: typer.Context,
     request_headers_path: Annotated[
-        Path,
+        Optional[Path],
         typer.Option(
-            ...,
             "--request-headers",
-            help="Path to JSON file containing request headers for Apple Music API",
+            help="Path to JSON file containing request headers for Apple Music API (required by commands that send requests)",
             exists=True,
             file_okay=True,
             dir_okay=False,
         ),
-    ],
+    ] = None,
     track_list_path: Annotated[
         Optional[Path],
         typer.Option(
@@ -51,12 +58,139 @@ def callback(
             max=10,
         ),
     ] = 3,
+    search_profile: Annotated[
+        SearchProfile,
+        typer.Option(
+            help="Search request profile: 'lean' requests only song fields used for matching, 'full' mirrors the Apple Music web client",
+        ),
+    ] = SearchProfile.lean,
+    adaptive_query_order: Annotated[
+        bool,
+        typer.Option(
+            help="Try first the query patterns that matched most often so far for the same source",
+        ),
+    ] = False,
+    speculative_search: Annotated[
+        bool,
+        typer.Option(
+            help="Send all query patterns for a track at once and keep the highest-priority match",
+        ),
+    ] = False,
     require_confirm: Annotated[
         bool,
         typer.Option(
-            help="Require confirmation for artist name mismatch (skips automatically if not set)",
+            help="Require confirmation for weak matches (skips automatically if not set)",
+        ),
+    ] = False,
+    defer_review: Annotated[
+        bool,
+        typer.Option(
+            help="Queue weak matches and tracks not found for the review command instead of prompting",
+        ),
+    ] = False,
+    concurrency: Annotated[
+        int,
+        typer.Option(
+            help="Number of Apple Music requests in flight at once",
+            min=1,
+        ),
+    ] = 1,
+    requests_per_second: Annotated[
+        float,
+        typer.Option(
+            help="Maximum rate of Apple Music requests shared by all workers",
+            min=0.01,
+        ),
+    ] = 1.0,
+    shared_rate_limit: Annotated[
+        Optional[Path],
+        typer.Option(
+            help="File holding the request budget shared by every process that uses it (one per credential)",
+            dir_okay=False,
+        ),
+    ] = None,
+    max_retries: Annotated[
+        int,
+        typer.Option(
+            help="Number of retries for a rate-limited or failed request before giving up",
+            min=0,
+        ),
+    ] = 10,
+    connect_timeout: Annotated[
+        float,
+        typer.Option(
+            help="Connect timeout in seconds for Apple Music requests",
+            min=0.1,
+        ),
+    ] = 10.0,
+    read_timeout: Annotated[
+        float,
+        typer.Option(
+            help="Read timeout in seconds for Apple Music requests",
+            min=0.1,
+        ),
+    ] = 30.0,
+    cache: Annotated[
+        bool,
+        typer.Option(
+            help="Cache Apple Music catalog search and ISRC responses on disk",
+        ),
+    ] = True,
+    refresh_cache: Annotated[
+        bool,
+        typer.Option(
+            "--refresh",
+            help="Ignore cached responses and replace them with fresh ones",
+        ),
+    ] = False,
+    cache_path: Annotated[
+        Optional[Path],
+        typer.Option(
+            help="Path to the response cache database (default: <track list>.cache)",
+            dir_okay=False,
+        ),
+    ] = None,
+    cache_ttl: Annotated[
+        float,
+        typer.Option(
+            help="Number of days a cached response stays valid",
+            min=0,
+        ),
+    ] = 30.0,
+    cache_size: Annotated[
+        int,
+        typer.Option(
+            help="Maximum number of cached responses (least recently used are evicted)",
+            min=1,
+        ),
+    ] = 200_000,
+    stats: Annotated[
+        bool,
+        typer.Option(
+            help="Print a table of request, cache, match and timing statistics at the end",
         ),
     ] = False,
+    metrics_file: Annotated[
+        Optional[Path],
+        typer.Option(
+            help="Write the run statistics as JSON to this file",
+            dir_okay=False,
+        ),
+    ] = None,
+    profile_dir: Annotated[
+        Optional[Path],
+        typer.Option(
+            help="Profile tag reading and merging with cProfile and write <phase>.prof files here",
+            file_okay=False,
+        ),
+    ] = None,
+    api_base_url: Annotated[
+        str,
+        typer.Option(
+            help="Base URL of the Apple Music API (e.g. a local mock server for benchmarks)",
+            hidden=True,
+        ),
+    ] = "https://amp-api.music.apple.com",
 ) -> None:
     """
     Track import tool for Apple Music
@@ -65,8 +199,27 @@ def callback(
     ctx.obj["request_headers"] = request_headers_path
     ctx.obj["country_code"] = country_code.lower()
     ctx.obj["limit"] = search_limit
+    ctx.obj["search_profile"] = search_profile
+    ctx.obj["adaptive_query_order"] = adaptive_query_order
+    ctx.obj["speculative_search"] = speculative_search
     ctx.obj["track_list"] = track_list_path
     ctx.obj["require_confirm"] = require_confirm
+    ctx.obj["defer_review"] = defer_review
+    ctx.obj["concurrency"] = concurrency
+    ctx.obj["requests_per_second"] = requests_per_second
+    ctx.obj["shared_rate_limit"] = shared_rate_limit
+    ctx.obj["max_retries"] = max_retries
+    ctx.obj["connect_timeout"] = connect_timeout
+    ctx.obj["read_timeout"] = read_timeout
+    ctx.obj["cache"] = cache
+    ctx.obj["refresh_cache"] = refresh_cache
+    ctx.obj["cache_path"] = cache_path
+    ctx.obj["cache_ttl"] = cache_ttl
+    ctx.obj["cache_size"] = cache_size
+    ctx.obj["stats"] = stats
+    ctx.obj["metrics_file"] = metrics_file
+    ctx.obj["metrics"] = Metrics(profile_dir)
+    ctx.obj["api_base_url"] = api_base_url.rstrip("/")
 
 
 if __name__ == "__main__":
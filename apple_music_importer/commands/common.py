@@ -0,0 +1,207 @@
+import json
+from pathlib import Path
+import typer
+from apple_music_importer.api.apple_music import AppleMusicAPI, slim_song
+from apple_music_importer.api.query_planner import QueryPlanner
+from apple_music_importer.cache import ResponseCache
+from apple_music_importer.concurrency import map_in_order
+from apple_music_importer.session import (
+    RateLimiter,
+    SessionHandler,
+    SharedRateLimiter,
+    ThrottlePolicy,
+)
+from apple_music_importer.shard import LeaseDirectory
+from apple_music_importer.utils import (
+    TrackJournal,
+    get_sidecar_path,
+    normalize_text,
+)
+
+
+def create_apple_music_api(ctx: typer.Context) -> AppleMusicAPI:
+    """Create an Apple Music API client from the global options."""
+    if ctx.obj["request_headers"] is None:
+        raise typer.BadParameter(
+            "This command requires the Apple Music request headers",
+            param_hint="'--request-headers'",
+        )
+    request_headers = json.loads(ctx.obj["request_headers"].read_text())
+    if ctx.obj["shared_rate_limit"] is not None:
+        rate_limiter = SharedRateLimiter(
+            ctx.obj["shared_rate_limit"], ctx.obj["requests_per_second"]
+        )
+    else:
+        rate_limiter = RateLimiter(ctx.obj["requests_per_second"])
+    session_handler = SessionHandler(
+        request_headers,
+        rate_limiter,
+        ThrottlePolicy(rate_limiter, max_retries=ctx.obj["max_retries"]),
+        timeout=(ctx.obj["connect_timeout"], ctx.obj["read_timeout"]),
+        metrics=ctx.obj["metrics"],
+    )
+    cache = None
+    if ctx.obj["cache"]:
+        cache = ResponseCache(
+            ctx.obj["cache_path"]
+            or get_sidecar_path(ctx.obj["track_list"] or Path("tracks.list"), "cache"),
+            ttl=ctx.obj["cache_ttl"] * 24 * 60 * 60,
+            max_entries=ctx.obj["cache_size"],
+            refresh=ctx.obj["refresh_cache"],
+        )
+    return AppleMusicAPI(
+        session_handler,
+        ctx.obj["country_code"],
+        ctx.obj["limit"],
+        cache,
+        ctx.obj["search_profile"],
+        QueryPlanner(adaptive=ctx.obj["adaptive_query_order"]),
+        ctx.obj["speculative_search"],
+        ctx.obj["api_base_url"],
+    )
+
+
+def close_apple_music_api(apple_music_api: AppleMusicAPI) -> None:
+    """Close the HTTP session and the response cache (enforcing its size limit)."""
+    apple_music_api.session_handler.session.close()
+    if apple_music_api.cache is not None:
+        apple_music_api.cache.close()
+
+
+def ensure_no_active_workers(track_list_path: Path) -> None:
+    """
+    Refuse to modify a track list while workers of a sharded run hold
+    leases on it, and remove the leases of finished runs.
+
+    Saving the track list folds the worker journals into it and removes
+    them, which would drop the results that running workers append later.
+    """
+    leases = LeaseDirectory(get_sidecar_path(track_list_path, "leases"), None)
+    active_workers = leases.active_workers()
+    if active_workers:
+        print(
+            f"Workers still running on {track_list_path}: "
+            f"{', '.join(sorted(map(str, active_workers)))}"
+        )
+        raise typer.Exit(code=1)
+    leases.clear()
+
+
+def search_track(
+    apple_music_api: AppleMusicAPI,
+    track: dict,
+    source: str,
+    require_confirm: bool = False,
+    return_weak: bool = False,
+):
+    """Search for a track on Apple Music by its tags and the duration from a source."""
+    return apple_music_api.search_track_from_text(
+        track["title"],
+        track["artist"],
+        track["album"],
+        require_confirm,
+        source,
+        (track.get(source) or {}).get("duration_ms"),
+        return_weak,
+    )
+
+
+def resolve_by_isrc(
+    apple_music_api: AppleMusicAPI,
+    track_list: list,
+    pending: list,
+    workers: int,
+    journal: TrackJournal,
+) -> list:
+    """Resolve pending tracks by ISRC in batches and return the unresolved ones."""
+    print(f"Resolving {len(pending)} tracks by ISRC...")
+    songs = apple_music_api.search_tracks_by_isrcs(
+        [track_list[index]["spotify"]["isrc"] for index in pending], workers
+    )
+    misses = []
+    for index in pending:
+        song = songs.get(track_list[index]["spotify"]["isrc"].upper())
+        if song is None:
+            misses.append(index)
+            continue
+        track_list[index]["apple_music"] = {
+            **slim_song(song),
+            "match_type": "isrc",
+            "confidence": 1.0,
+        }
+        journal.record(index)
+        apple_music_api.session_handler.metrics.record_match("isrc")
+    print(f"Found {len(pending) - len(misses)} tracks by ISRC")
+    return misses
+
+
+def report_metrics(ctx: typer.Context) -> None:
+    """Print the run statistics and write the metrics file and profiles if requested."""
+    metrics = ctx.obj["metrics"]
+    print(metrics.summary_table() if ctx.obj["stats"] else metrics.summary_line())
+    if ctx.obj["metrics_file"] is not None:
+        metrics.save(ctx.obj["metrics_file"])
+    metrics.dump_profiles()
+
+
+def get_search_key(track: dict) -> tuple:
+    """Return the key under which tracks are searched only once."""
+    return tuple(
+        normalize_text(track.get(field, "")) for field in ("title", "artist", "album")
+    )
+
+
+def _copy_result(result):
+    return dict(result) if result is not None else None
+
+
+class SearchCoalescer:
+    """
+    Send one search per normalized (title, artist, album) among pending tracks.
+
+    The first track with a key is searched; later tracks with the same key
+    wait for that search, or reuse its result if it already finished.
+    """
+
+    def __init__(self, track_list: list, metrics=None):
+        self.track_list = track_list
+        self.metrics = metrics
+        self.waiting = {}
+        self.finished = {}
+        self.leader_keys = {}
+        self.ready = []
+        self.avoided = 0
+
+    def _leaders(self, indexes):
+        for index in indexes:
+            key = get_search_key(self.track_list[index])
+            if key in self.finished or key in self.waiting:
+                self.avoided += 1
+                if self.metrics is not None:
+                    self.metrics.record_coalesced()
+                if key in self.finished:
+                    self.ready.append((index, _copy_result(self.finished[key])))
+                else:
+                    self.waiting[key].append(index)
+                continue
+            self.waiting[key] = []
+            self.leader_keys[index] = key
+            yield index
+
+    def _drain_ready(self):
+        ready, self.ready = self.ready, []
+        yield from ready
+
+    def search(self, search, indexes, workers=1):
+        """
+        Yield (index, result) for every pending index, calling search(index)
+        once per key; indexes may be a lazy iterator.
+        """
+        for leader, result in map_in_order(search, self._leaders(indexes), workers):
+            yield from self._drain_ready()
+            key = self.leader_keys.pop(leader)
+            self.finished[key] = result
+            yield leader, result
+            for index in self.waiting.pop(key):
+                yield index, _copy_result(result)
+        yield from self._drain_ready()
@@ -1,72 +1,350 @@
 import os
-import json
+from collections import deque
 from pathlib import Path
+from typing import List, Optional
 import typer
-from apple_music_importer.metadata import MetadataHandler
+from apple_music_importer.metadata import MetadataHandler, TagReader
 from apple_music_importer.api.apple_music import AppleMusicAPI
-from apple_music_importer.session import SessionHandler, UnauthorizedRequestException
-from apple_music_importer.utils import load_track_list, save_track_list, merge_tracks
+from apple_music_importer.commands.common import (
+    close_apple_music_api,
+    SearchCoalescer,
+    create_apple_music_api,
+    ensure_no_active_workers,
+    report_metrics,
+    search_track,
+)
+from apple_music_importer.concurrency import prefetch_batches, prompt_lock
+from apple_music_importer.dedup import Deduplicator
+from apple_music_importer.review_queue import ReviewQueue
+from apple_music_importer.scan_index import ScanIndex
+from apple_music_importer.scanner import (
+    DEFAULT_EXTENSIONS,
+    DirectoryScanner,
+    IgnoreRules,
+)
+from apple_music_importer.session import (
+    RateLimitExceededException,
+    UnauthorizedRequestException,
+)
+from apple_music_importer.utils import (
+    TrackJournal,
+    TrackMerger,
+    get_sidecar_path,
+    load_track_list,
+)
 
 
-def _get_file_list_recursive(folder_path: str) -> list:
-    """Recursively get all MP3 files in the given folder."""
-    files = []
-    for root, _, filenames in os.walk(folder_path):
-        for file in filenames:
-            if file.lower().endswith(".mp3"):
-                files.append(os.path.join(root, file))
-    print(f"Found {len(files)} mp3 files")
-    return files
+# Maximum number of read tags waiting to be merged into the track list
+TAG_QUEUE_SIZE = 1000
+# Maximum number of read tags merged into the track list at once
+MERGE_BATCH_SIZE = 500
 
 
-def _edit_metadata_interactively(track: dict) -> bool:
-    """Edit mp3 tag metadata interactively."""
-    print("Edit mp3 tag metadata interactively...")
-    track["title"] = input(f"Title ({track['title']}): ") or track["title"]
-    track["artist"] = input(f"Artist ({track['artist']}): ") or track["artist"]
-    track["album"] = input(f"Album ({track['album']}): ") or track["album"]
-
-    confirm_message = (
-        f"Track will be saved with the new metadata\n"
-        f"Title: {track['title']}\n"
-        f"Artist: {track['artist']}\n"
-        f"Album: {track['album']}\n(Y/n): "
+def _get_file_list_recursive(folder_path: str, scanner: DirectoryScanner):
+    """Recursively yield all audio files in the given folder as they are found."""
+    yield from scanner.walk(folder_path)
+    print(f"Found {scanner.files} audio files in {scanner.directories} directories")
+
+
+def _get_local_paths(track: dict) -> list:
+    """Return the path of a local track followed by the paths of its copies."""
+    local = track.get("local")
+    if not isinstance(local, dict) or "path" not in local:
+        return []
+    return [local["path"]] + local.get("duplicates", [])
+
+
+def _remove_duplicate(track: dict, path: str) -> None:
+    duplicates = track["local"].get("duplicates", [])
+    if path in duplicates:
+        duplicates.remove(path)
+    if not duplicates:
+        track["local"].pop("duplicates", None)
+
+
+def _remove_deleted_files(track_list: list, removed: set) -> None:
+    """
+    Drop the local data of deleted files, and tracks with no other source.
+
+    A deleted file that has copies is replaced by its first remaining copy.
+    """
+    remaining = []
+    for track in track_list:
+        local = track.get("local")
+        if isinstance(local, dict) and local.get("duplicates"):
+            for path in removed.intersection(local["duplicates"]):
+                _remove_duplicate(track, path)
+            if local.get("path") in removed and local.get("duplicates"):
+                local["path"] = local["duplicates"].pop(0)
+                local["filename"] = os.path.basename(local["path"])
+                if not local["duplicates"]:
+                    del local["duplicates"]
+        if track.get("local", {}).get("path") in removed:
+            if "spotify" not in track:
+                continue
+            del track["local"]
+        remaining.append(track)
+    track_list[:] = remaining
+
+
+def _iter_changed_files(
+    folder_path: str,
+    scanner: DirectoryScanner,
+    scan_index: ScanIndex,
+    known_paths: set,
+    seen_files: set,
+    include_unhashed: bool = False,
+):
+    """
+    Yield (path, (size, mtime), changed) for new or modified files,
+    recording every file seen.
+
+    With include_unhashed, unchanged files whose audio hash is not cached
+    yet are yielded as well, with changed set to False.
+    """
+    for file in _get_file_list_recursive(folder_path, scanner):
+        seen_files.add(file)
+        try:
+            size, mtime = ScanIndex.stat(file)
+        except OSError as e:
+            print(f"Error reading {file}: {e}")
+            continue
+        if file in known_paths and scan_index.is_current(file, size, mtime):
+            if include_unhashed and scan_index.get_hash(file, size, mtime) is None:
+                yield file, (size, mtime), False
+            continue
+        yield file, (size, mtime), True
+
+
+def _iter_changed_track_info(
+    folder_path: str,
+    scanner: DirectoryScanner,
+    scan_index: ScanIndex,
+    known_paths: set,
+    seen_files: set,
+    artist_name_position: int,
+    album_name_position: int,
+    tag_reader: TagReader,
+    tag_workers: int,
+    deduplicator: Deduplicator = None,
+):
+    """
+    Yield (path, track_info, (size, mtime), hash, primary path) for new or
+    modified files as their tags are read.
+
+    With a deduplicator, copies of the audio data of another file are
+    yielded without reading their tags (track_info None and the path of
+    the other file as primary path), and so are unchanged files whose hash
+    was computed (track_info and primary path None).
+    """
+    file_info = {}
+    skipped = deque()
+    files = _iter_changed_files(
+        folder_path,
+        scanner,
+        scan_index,
+        known_paths,
+        seen_files,
+        deduplicator is not None,
     )
-    if input(confirm_message).lower() == "y":
-        # Save the edited track information into mp3 file
-        MetadataHandler.save_metadata_to_mp3(
-            track["local"]["path"],
-            track["title"],
-            track["artist"],
-            track["album"],
-        )
-        return True
+    if deduplicator is not None:
+        files = deduplicator.iter_hashed(files)
     else:
-        return False
+        files = ((file, stat, changed, None, None) for file, stat, changed in files)
+
+    def changed_paths():
+        for file, stat, changed, content_hash, primary in files:
+            if changed and primary is None:
+                file_info[file] = (stat, content_hash)
+                yield file
+            else:
+                skipped.append((file, None, stat, content_hash, primary))
+
+    for path, track_info in MetadataHandler.iter_track_info(
+        changed_paths(),
+        artist_name_position,
+        album_name_position,
+        tag_reader,
+        tag_workers,
+    ):
+        while skipped:
+            yield skipped.popleft()
+        stat, content_hash = file_info.pop(path)
+        if track_info is not None:
+            yield path, track_info, stat, content_hash, None
+    yield from skipped
+
+
+def _merge_scanned_tracks(
+    batch: list,
+    track_list: list,
+    scan_index: ScanIndex,
+    index_by_path: dict,
+    merger: TrackMerger,
+    pending_duplicates: dict = None,
+) -> list:
+    """
+    Reconcile a batch of read tags with the track list.
+
+    Copies of another file are recorded in the "duplicates" of its track
+    once that file is in the track list; until then they are kept in
+    pending_duplicates by the path of the other file.
+
+    Returns the indexes of all tracks that were added or modified.
+    """
+    new_tracks = []
+    changed = []
+    for path, track_info, stat, content_hash, primary in batch:
+        if track_info is None:
+            if primary is not None:
+                pending_duplicates.setdefault(primary, []).append(
+                    (path, stat, content_hash)
+                )
+            elif content_hash is not None:
+                scan_index.set_hash(path, content_hash)
+            continue
+        tags = {key: track_info[key] for key in ("title", "artist", "album")}
+        previous_tags = scan_index.get_tags(path)
+        scan_index.update(path, *stat, tags, content_hash)
+
+        index = index_by_path.get(path)
+        if index is not None and track_list[index]["local"]["path"] != path:
+            # A copy whose audio data changed becomes a track of its own
+            _remove_duplicate(track_list[index], path)
+            changed.append(index)
+            index = None
+        if index is None:
+            new_tracks.append(track_info)
+        elif previous_tags is not None and previous_tags != tags:
+            # Search again with the new tags
+            print(f"Tags changed: {path}")
+            merger.remove(index)
+            track_list[index].update(tags)
+            track_list[index].pop("apple_music", None)
+            merger.add(index)
+            changed.append(index)
+
+    for index in merger.merge("local", new_tracks):
+        index_by_path[track_list[index]["local"]["path"]] = index
+        changed.append(index)
+
+    attachable = [path for path in pending_duplicates or {} if path in index_by_path]
+    for primary in attachable:
+        index = index_by_path[primary]
+        track = track_list[index]
+        tags = {key: track[key] for key in ("title", "artist", "album")}
+        for path, stat, content_hash in pending_duplicates.pop(primary):
+            scan_index.update(path, *stat, tags, content_hash)
+            previous_index = index_by_path.get(path)
+            if previous_index == index:
+                continue
+            if previous_index is not None:
+                _remove_duplicate(track_list[previous_index], path)
+                changed.append(previous_index)
+            track["local"].setdefault("duplicates", []).append(path)
+            index_by_path[path] = index
+            changed.append(index)
+    return list(dict.fromkeys(changed))
+
+
+def _prune_deleted_files(
+    folder_path: str,
+    track_list: list,
+    scan_index: ScanIndex,
+    scanner: DirectoryScanner,
+    seen_files: set,
+) -> None:
+    """
+    Remove files below folder_path that were not seen during the scan.
+
+    Nothing is removed if the folder or any directory below it could not
+    be read, since its files would all look deleted. Files that still exist
+    or whose directory was not listed (e.g. because it is excluded now) are
+    kept.
+    """
+    if not os.path.isdir(folder_path) or scanner.errors:
+        print("Not removing deleted files: the folder could not be fully read")
+        return
+    prefix = os.path.join(folder_path, "")
+    unseen = {
+        file
+        for file in scan_index.entries
+        if file.startswith(prefix) and file not in seen_files
+    }
+    unseen.update(
+        path
+        for track in track_list
+        for path in _get_local_paths(track)
+        if path.startswith(prefix) and path not in seen_files
+    )
+    kept = {
+        file
+        for file in unseen
+        if os.path.dirname(file) not in scanner.listed or os.path.exists(file)
+    }
+    scan_index.prune(folder_path, seen_files | kept)
+    removed = unseen - kept
+    if removed:
+        print(f"Removing {len(removed)} deleted files")
+        _remove_deleted_files(track_list, removed)
+
 
+def _edit_metadata_interactively(track: dict) -> bool:
+    """Edit mp3 tag metadata interactively."""
+    with prompt_lock:
+        print("Edit mp3 tag metadata interactively...")
+        track["title"] = input(f"Title ({track['title']}): ") or track["title"]
+        track["artist"] = input(f"Artist ({track['artist']}): ") or track["artist"]
+        track["album"] = input(f"Album ({track['album']}): ") or track["album"]
 
-def _search_and_update_track(
-    apple_music_api: AppleMusicAPI, track: dict, require_confirm: bool, edit_tag: bool
-) -> dict:
-    """Search for a track on Apple Music and update the track information."""
-    search_result = apple_music_api.search_track_from_text(
+        confirm_message = (
+            f"Track will be saved with the new metadata\n"
+            f"Title: {track['title']}\n"
+            f"Artist: {track['artist']}\n"
+            f"Album: {track['album']}\n(Y/n): "
+        )
+        if input(confirm_message).lower() != "y":
+            return False
+
+    # Save the edited track information into mp3 file
+    MetadataHandler.save_metadata_to_mp3(
+        track["local"]["path"],
         track["title"],
         track["artist"],
         track["album"],
-        require_confirm,
+    )
+    return True
+
+
+def _search_track(
+    apple_music_api: AppleMusicAPI,
+    track: dict,
+    require_confirm: bool,
+    edit_tag: bool,
+    defer_review: bool = False,
+):
+    """
+    Search for a track on Apple Music, editing its tags if requested.
+
+    With defer_review, weak matches are returned as they are and nothing is
+    asked, so that they can be queued for review.
+    """
+    search_result = search_track(
+        apple_music_api,
+        track,
+        "local",
+        require_confirm and not defer_review,
+        defer_review,
     )
 
     if search_result is None:
         print(f"No results found for {track['title']} by {track['artist']}")
-        if edit_tag:
+        if edit_tag and not defer_review:
             success = _edit_metadata_interactively(track)
             if success:
-                return _search_and_update_track(
-                    apple_music_api, track, require_confirm, edit_tag
-                )
+                return _search_track(apple_music_api, track, require_confirm, edit_tag)
 
-    track["apple_music"] = search_result
-    return track
+    return search_result
 
 
 def local(
@@ -87,64 +365,206 @@ def local(
         "--edit-tag",
         help="Edit mp3 tag metadata interactively (only if the song is not found in Apple Music)",
     ),
+    tag_reader: TagReader = typer.Option(
+        TagReader.eyed3,
+        "--tag-reader",
+        help="Tag parser: 'eyed3' parses whole files, 'fast' reads only the ID3v2/ID3v1 tag regions",
+    ),
+    tag_workers: int = typer.Option(
+        1,
+        "--tag-workers",
+        min=1,
+        help="Number of processes reading audio tags in parallel",
+    ),
+    extensions: List[str] = typer.Option(
+        list(DEFAULT_EXTENSIONS),
+        "--extension",
+        help="Extension of the audio files to scan (repeat for several; files without ID3 tags are named after their path)",
+    ),
+    exclude: List[str] = typer.Option(
+        [],
+        "--exclude",
+        help="Gitignore-style pattern of files and folders to skip, relative to the folder (repeatable)",
+    ),
+    exclude_from: Optional[Path] = typer.Option(
+        None,
+        "--exclude-from",
+        exists=True,
+        dir_okay=False,
+        help="File of gitignore-style exclude patterns, one per line",
+    ),
+    scan_workers: int = typer.Option(
+        8,
+        "--scan-workers",
+        min=1,
+        help="Number of threads listing directories in parallel",
+    ),
+    dedup: bool = typer.Option(
+        False,
+        "--dedup",
+        help="Record copies of the same audio data (ignoring tags) under one track instead of searching each copy",
+    ),
+    hash_workers: int = typer.Option(
+        4,
+        "--hash-workers",
+        min=1,
+        help="Number of threads hashing audio data in parallel (with --dedup)",
+    ),
 ):
     """
     Search local music files in Apple Music.
     """
     track_list_path = ctx.obj["track_list"] or Path("tracks.list")
+    ensure_no_active_workers(track_list_path)
     track_list = load_track_list(track_list_path)
 
-    # Load track information from local music files if no progress file is found
-    print("Loading local music files...")
-    files = _get_file_list_recursive(str(folder_path))
-    new_files = [
-        file
-        for file in files
-        if file not in [item.get("local", {}).get("path", "") for item in track_list]
-    ]
-    track_list = merge_tracks(
-        "local",
-        MetadataHandler.get_track_list_from_files(
-            new_files, artist_name_position, album_name_position
-        ),
-        track_list,
+    scan_index = ScanIndex(get_sidecar_path(track_list_path, "scan"))
+    index_by_path = {
+        path: index
+        for index, track in enumerate(track_list)
+        for path in _get_local_paths(track)
+    }
+    seen_files = set()
+    # Patterns given on the command line take precedence over the file
+    patterns = (
+        exclude_from.read_text(encoding="utf-8").splitlines() if exclude_from else []
     )
-    save_track_list(track_list, track_list_path)
-
-    request_headers = json.loads(ctx.obj["request_headers"].read_text())
-    session_handler = SessionHandler(request_headers)
+    scanner = DirectoryScanner(
+        extensions, IgnoreRules(patterns + exclude), scan_workers
+    )
+    deduplicator = None
+    pending_duplicates = {}
+    if dedup:
+        primary_paths = set()
+        primary_by_hash = {}
+        for track in track_list:
+            for path in _get_local_paths(track)[:1]:
+                primary_paths.add(path)
+                content_hash = scan_index.entries.get(path, {}).get("hash")
+                if content_hash is not None:
+                    primary_by_hash.setdefault(content_hash, path)
+        deduplicator = Deduplicator(
+            scan_index, primary_by_hash, primary_paths, hash_workers
+        )
+    with ctx.obj["metrics"].phase("merge"):
+        merger = TrackMerger(track_list)
 
-    apple_music_api = AppleMusicAPI(
-        session_handler,
-        ctx.obj["country_code"],
-        ctx.obj["limit"],
+    apple_music_api = create_apple_music_api(ctx)
+    metrics = ctx.obj["metrics"]
+    journal = TrackJournal(track_list, track_list_path)
+    coalescer = SearchCoalescer(track_list, metrics)
+    review_queue = (
+        ReviewQueue(get_sidecar_path(track_list_path, "review"))
+        if ctx.obj["defer_review"]
+        else None
     )
 
-    try:
-        # Search tracks using Apple Music API
-        track_list_with_apple_music_info = []
+    def iter_pending():
+        """Yield tracks to search: pending ones first, then scanned files as they stream in."""
+        # Files are scanned and tags read in a background thread meanwhile
+        print("Loading local music files...")
+        batches = prefetch_batches(
+            metrics.timed_iter(
+                "tags",
+                _iter_changed_track_info(
+                    str(folder_path),
+                    scanner,
+                    scan_index,
+                    set(index_by_path),
+                    seen_files,
+                    artist_name_position,
+                    album_name_position,
+                    tag_reader,
+                    tag_workers,
+                    deduplicator,
+                ),
+            ),
+            TAG_QUEUE_SIZE,
+            MERGE_BATCH_SIZE,
+        )
+        queued = set()
+        for index, track in enumerate(track_list):
+            if "apple_music" not in track:
+                queued.add(index)
+                yield index
 
-        for i, track in enumerate(track_list, 1):
-            if "apple_music" in track:
-                track_list_with_apple_music_info.append(track)
-                continue
+        for batch in batches:
+            with metrics.phase("merge"):
+                changed = _merge_scanned_tracks(
+                    batch,
+                    track_list,
+                    scan_index,
+                    index_by_path,
+                    merger,
+                    pending_duplicates,
+                )
+            for index in changed:
+                journal.record(index)
+                if "apple_music" not in track_list[index] and index not in queued:
+                    queued.add(index)
+                    yield index
 
-            print(
-                f"Searching track {i}/{len(track_list)}: {track['title']} by {track['artist']}"
+    def search(index):
+        track = track_list[index]
+        print(
+            f"Searching track {index + 1}/{len(track_list)}: {track['title']} by {track['artist']}"
+        )
+        return _search_track(
+            apple_music_api,
+            track,
+            ctx.obj["require_confirm"],
+            edit_tag,
+            review_queue is not None,
+        )
+
+    try:
+        # Search tracks using Apple Music API, journaling each result in list order
+        # Tracks with the same normalized title, artist and album share one search
+        for index, search_result in coalescer.search(
+            search, iter_pending(), ctx.obj["concurrency"]
+        ):
+            if review_queue is not None:
+                search_result = review_queue.defer(
+                    "local", track_list[index], search_result
+                )
+            track_list[index]["apple_music"] = search_result
+            journal.record(index)
+            metrics.record_match(search_result and search_result.get("match_type"))
+
+        if coalescer.avoided:
+            print(f"Reused results for {coalescer.avoided} duplicate tracks")
+        _prune_deleted_files(
+            str(folder_path), track_list, scan_index, scanner, seen_files
+        )
+        if deduplicator is not None:
+            copies = sum(
+                len(track["local"].get("duplicates", []))
+                for track in track_list
+                if isinstance(track.get("local"), dict)
             )
-            updated_track = _search_and_update_track(
-                apple_music_api, track, ctx.obj["require_confirm"], edit_tag
+            print(
+                f"Hashed {deduplicator.hashed} files; "
+                f"{copies} files are recorded as copies of other tracks"
             )
-            track_list_with_apple_music_info.append(updated_track)
-
-        save_track_list(track_list_with_apple_music_info, track_list_path)
+        journal.compact()
         print("Search complete!")
 
-    except (KeyboardInterrupt, UnauthorizedRequestException):
-        if typer.confirm("\nProcess interrupted. Do you want to save progress?"):
-            save_track_list(track_list, track_list_path)
+    except (
+        KeyboardInterrupt,
+        UnauthorizedRequestException,
+        RateLimitExceededException,
+    ):
+        print("\nProcess interrupted.")
+        journal.compact()
     except Exception as e:
         print(f"Error: {e}")
         raise typer.Exit(code=1)
     finally:
-        session_handler.session.close()
+        journal.close()
+        scan_index.save()
+        if review_queue is not None:
+            review_queue.close()
+            if review_queue.count:
+                print(f"Queued {review_queue.count} tracks for review")
+        report_metrics(ctx)
+        close_apple_music_api(apple_music_api)
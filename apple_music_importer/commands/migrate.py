@@ -0,0 +1,42 @@
+import typer
+from pathlib import Path
+from typing import Annotated, Optional
+from apple_music_importer.api.apple_music import slim_song
+from apple_music_importer.commands.common import ensure_no_active_workers
+from apple_music_importer.utils import load_track_list, save_track_list
+
+
+def migrate(
+    ctx: typer.Context,
+    output: Annotated[
+        Optional[Path],
+        typer.Option(
+            "--output",
+            help="Write the migrated track list here instead of replacing it (a name ending in .gz compresses it); sidecar files are not moved",
+            dir_okay=False,
+        ),
+    ] = None,
+):
+    """
+    Slim down the Apple Music results stored in the track list.
+    """
+    track_list_path = ctx.obj["track_list"] or Path("tracks.list")
+    if not track_list_path.exists():
+        print(f"{track_list_path} does not exist")
+        raise typer.Exit(code=1)
+    ensure_no_active_workers(track_list_path)
+    size = track_list_path.stat().st_size
+    track_list = load_track_list(track_list_path)
+
+    slimmed = 0
+    for track in track_list:
+        if isinstance(track.get("apple_music"), dict):
+            track["apple_music"] = slim_song(track["apple_music"])
+            slimmed += 1
+
+    output = output or track_list_path
+    save_track_list(track_list, output)
+    print(
+        f"Slimmed {slimmed} Apple Music results: "
+        f"{size / 1024:.0f} KiB -> {output.stat().st_size / 1024:.0f} KiB"
+    )
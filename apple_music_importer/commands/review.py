@@ -0,0 +1,179 @@
+import typer
+from pathlib import Path
+from apple_music_importer.commands.common import (
+    close_apple_music_api,
+    create_apple_music_api,
+    ensure_no_active_workers,
+    report_metrics,
+    search_track,
+)
+from apple_music_importer.concurrency import map_in_order
+from apple_music_importer.metadata import MetadataHandler
+from apple_music_importer.review_queue import (
+    ReviewQueue,
+    get_track_key,
+    needs_review,
+)
+from apple_music_importer.scan_index import ScanIndex
+from apple_music_importer.session import (
+    RateLimitExceededException,
+    UnauthorizedRequestException,
+)
+from apple_music_importer.utils import (
+    TrackJournal,
+    get_sidecar_path,
+    load_track_list,
+)
+
+
+def _describe_candidate(candidate: dict) -> str:
+    attributes = candidate.get("attributes", {})
+    return (
+        f"{attributes.get('name')} by {attributes.get('artistName')} "
+        f"({attributes.get('albumName')}), confidence {candidate.get('confidence', 0):.2f}"
+    )
+
+
+def _prompt_search_terms(track: dict) -> dict:
+    """Ask for corrected title, artist and album, keeping the current values by default."""
+    return {
+        "title": input(f"Title ({track['title']}): ") or track["title"],
+        "artist": input(f"Artist ({track['artist']}): ") or track["artist"],
+        "album": input(f"Album ({track['album']}): ") or track["album"],
+    }
+
+
+def _review_entry(entry: dict, track: dict, position: str):
+    """
+    Ask what to do with a queued track.
+
+    Returns "accept", "reject", "skip", or the corrected search terms.
+    """
+    print(f"\n[{position}] {track['title']} by {track['artist']} ({track['album']})")
+    if entry["candidate"] is not None:
+        print(f"Candidate: {_describe_candidate(entry['candidate'])}")
+        question = "Accept (y), reject (n), edit and search again (e) or skip (s)? "
+        choices = {"y": "accept", "n": "reject", "s": "skip"}
+    else:
+        print("Not found on Apple Music")
+        question = "Edit and search again (e), mark as not found (n) or skip (s)? "
+        choices = {"n": "reject", "s": "skip"}
+    while True:
+        answer = input(question).lower()
+        if answer == "e":
+            return _prompt_search_terms(track)
+        if answer in choices:
+            return choices[answer]
+
+
+def review(ctx: typer.Context):
+    """
+    Review weak matches and tracks not found, queued by --defer-review.
+    """
+    track_list_path = ctx.obj["track_list"] or Path("tracks.list")
+    ensure_no_active_workers(track_list_path)
+    track_list = load_track_list(track_list_path)
+    review_queue = ReviewQueue(get_sidecar_path(track_list_path, "review"))
+    entries = review_queue.load()
+    if not entries:
+        print("No tracks to review")
+        return
+
+    tracks_by_key = {
+        (source, get_track_key(source, track)): index
+        for index, track in enumerate(track_list)
+        for source in ("local", "spotify")
+        if isinstance(track.get(source), dict)
+    }
+    journal = TrackJournal(track_list, track_list_path)
+    remaining = []
+    corrected = []
+
+    # Go through the whole queue first; nothing is sent in the meantime
+    try:
+        for position, entry in enumerate(entries, 1):
+            index = tracks_by_key.get((entry["source"], entry["key"]))
+            if index is None or track_list[index].get("apple_music"):
+                continue  # Removed from the track list or matched since
+            decision = _review_entry(
+                entry, track_list[index], f"{position}/{len(entries)}"
+            )
+            if decision == "accept":
+                track_list[index]["apple_music"] = {
+                    **entry["candidate"],
+                    "match_type": "reviewed",
+                }
+                journal.record(index)
+            elif decision == "skip":
+                remaining.append(entry)
+            elif decision != "reject":
+                track_list[index].update(decision)
+                journal.record(index)
+                corrected.append((index, entry))
+    except (KeyboardInterrupt, EOFError):
+        print("\nReview interrupted; unreviewed tracks stay queued.")
+        remaining += entries[position - 1 :]
+
+    # Write all tag edits to the local files at once
+    edited = [index for index, entry in corrected if entry["source"] == "local"]
+    if edited:
+        print(f"Saving the tags of {len(edited)} files...")
+        scan_index = ScanIndex(get_sidecar_path(track_list_path, "scan"))
+        for index in edited:
+            track = track_list[index]
+            path = track["local"]["path"]
+            if not MetadataHandler.save_metadata_to_mp3(
+                path, track["title"], track["artist"], track["album"]
+            ):
+                # The next scan reads the unchanged tags of the file again
+                continue
+            # Keep the next scan from searching the file again
+            try:
+                tags = {key: track[key] for key in ("title", "artist", "album")}
+                scan_index.update(path, *ScanIndex.stat(path), tags)
+            except OSError as e:
+                print(f"Error reading {path}: {e}")
+        scan_index.save()
+
+    # Search again for the corrected tracks only
+    if corrected:
+        apple_music_api = create_apple_music_api(ctx)
+        print(f"Searching {len(corrected)} corrected tracks...")
+
+        def search(pair):
+            index, entry = pair
+            return search_track(
+                apple_music_api, track_list[index], entry["source"], return_weak=True
+            )
+
+        searched = set()
+        try:
+            for (index, entry), search_result in map_in_order(
+                search, corrected, ctx.obj["concurrency"]
+            ):
+                searched.add(index)
+                if needs_review(search_result):
+                    remaining.append(
+                        ReviewQueue.make_entry(
+                            entry["source"], track_list[index], search_result
+                        )
+                    )
+                    search_result = None
+                track_list[index]["apple_music"] = search_result
+                journal.record(index)
+        except (UnauthorizedRequestException, RateLimitExceededException) as e:
+            print(f"Error: {e}")
+        finally:
+            # Tracks that were not searched again stay queued with their corrections
+            remaining += [
+                ReviewQueue.make_entry(entry["source"], track_list[index], None)
+                for index, entry in corrected
+                if index not in searched
+            ]
+            report_metrics(ctx)
+            close_apple_music_api(apple_music_api)
+
+    journal.compact()
+    journal.close()
+    review_queue.replace(remaining)
+    print(f"{len(remaining)} tracks still queued for review")
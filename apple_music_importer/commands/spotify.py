@@ -4,8 +4,52 @@ from pathlib import Path
 from typing import Annotated
 from apple_music_importer.api.spotify import SpotifyAPI
 from apple_music_importer.api.apple_music import AppleMusicAPI
-from apple_music_importer.utils import load_track_list, save_track_list, merge_tracks
-from apple_music_importer.session import SessionHandler, UnauthorizedRequestException
+from apple_music_importer.commands.common import (
+    close_apple_music_api,
+    SearchCoalescer,
+    create_apple_music_api,
+    ensure_no_active_workers,
+    report_metrics,
+    resolve_by_isrc,
+    search_track,
+)
+from apple_music_importer.review_queue import ReviewQueue
+from apple_music_importer.utils import (
+    TrackJournal,
+    atomic_write_text,
+    get_sidecar_path,
+    load_track_list,
+    save_track_list,
+    merge_tracks,
+)
+from apple_music_importer.session import (
+    RateLimitExceededException,
+    UnauthorizedRequestException,
+)
+
+
+def _search_track(
+    apple_music_api: AppleMusicAPI, track: dict, defer_review: bool = False
+):
+    """Search for a Spotify track on Apple Music by title and artist."""
+    search_result = search_track(
+        apple_music_api, track, "spotify", return_weak=defer_review
+    )
+    (print("Could not be found") if search_result is None else print("Found"))
+    return search_result
+
+
+def _load_playlist_tracks(
+    spotify_api: SpotifyAPI,
+    playlist: str,
+    watermark: dict,
+    fetch_workers: int,
+) -> list:
+    """Fetch the playlist tracks added since the watermark (all without one)."""
+    if watermark and watermark.get("added_at"):
+        print(f"Loading tracks added since {watermark['added_at']}...")
+        return spotify_api.get_tracks_added_since(playlist, watermark["added_at"])
+    return spotify_api.get_playlist_tracks(playlist, fetch_workers)
 
 
 def spotify(
@@ -13,6 +57,20 @@ def spotify(
     playlist: Annotated[
         str, typer.Argument(help="Spotify playlist ID, URL, or 'liked' for liked songs")
     ] = "liked",
+    fetch_workers: Annotated[
+        int,
+        typer.Option(
+            "--fetch-workers",
+            help="Number of Spotify pages fetched in parallel",
+            min=1,
+        ),
+    ] = 4,
+    incremental: Annotated[
+        bool,
+        typer.Option(
+            help="Only fetch tracks added since the last import of this playlist",
+        ),
+    ] = False,
 ):
     """
     Search Spotify playlist in Apple Music.
@@ -20,53 +78,110 @@ def spotify(
 
     # Load track information from the track list file
     track_list_path = ctx.obj["track_list"] or Path("tracks.list")
+    ensure_no_active_workers(track_list_path)
     track_list = load_track_list(track_list_path)
 
-    # Load tracks from the Spotify playlist
+    # Load tracks from the Spotify playlist, only new ones in incremental mode
     spotify_api = SpotifyAPI()
     print(f"Loading tracks from Spotify playlist {playlist}...")
-    playlist_tracks = spotify_api.get_playlist_tracks(playlist)
+    watermarks_path = get_sidecar_path(track_list_path, "spotify")
+    watermarks = (
+        json.loads(watermarks_path.read_text()) if watermarks_path.exists() else {}
+    )
+    watermark = watermarks.get(playlist) if incremental else None
+    snapshot_id = spotify_api.get_snapshot_id(playlist) if incremental else None
+    if (
+        watermark
+        and snapshot_id is not None
+        and watermark.get("snapshot_id") == snapshot_id
+    ):
+        print("Playlist is unchanged since the last import")
+        merged_track_list = track_list
+    else:
+        playlist_tracks = _load_playlist_tracks(
+            spotify_api, playlist, watermark, fetch_workers
+        )
 
-    # Search for each track in track list and append the value as "spotify" key
-    ## The priority is:
-    ## 1. Search by ISRC
-    ## 2. Search by title and artist
-    ## 3. Search by title
-    # If no match is found, the track should be newly added to the track list
-    print("Merging tracks...")
-    merged_track_list = merge_tracks("spotify", playlist_tracks, track_list)
+        # Search for each track in track list and append the value as "spotify" key
+        ## The priority is:
+        ## 1. Search by ISRC
+        ## 2. Search by title and artist
+        ## 3. Search by title
+        # If no match is found, the track should be newly added to the track list
+        print("Merging tracks...")
+        with ctx.obj["metrics"].phase("merge"):
+            merged_track_list = merge_tracks("spotify", playlist_tracks, track_list)
 
-    # Save the updated track list
-    save_track_list(merged_track_list, track_list_path)
+        # Save the updated track list
+        save_track_list(merged_track_list, track_list_path)
+        # Old playlist entries have no timestamp
+        added_at = [
+            track["date_added"] for track in playlist_tracks if track["date_added"]
+        ]
+        watermarks[playlist] = {
+            "snapshot_id": snapshot_id,
+            "added_at": max(
+                added_at + [watermarks.get(playlist, {}).get("added_at") or ""]
+            ),
+        }
+        atomic_write_text(watermarks_path, json.dumps(watermarks))
 
     # Update the track list if it does not have the "apple_music" key
-    request_headers = json.loads(ctx.obj["request_headers"].read_text())
-    session_handler = SessionHandler(request_headers)
-    apple_music_api = AppleMusicAPI(
-        session_handler,
-        ctx.obj["country_code"],
-        ctx.obj["limit"],
-    )
+    apple_music_api = create_apple_music_api(ctx)
+
+    def search(index):
+        track = merged_track_list[index]
+        print(
+            f"Searching track {index + 1}/{len(merged_track_list)}: {track['title']} by {track['artist']}..."
+        )
+        return _search_track(apple_music_api, track, review_queue is not None)
+
     print("Updating track list...")
-    for i, track in enumerate(merged_track_list):
-        if "apple_music" not in track and "spotify" in track:
-            print(
-                f"Searching track {i+1}/{len(merged_track_list)}: {track['title']} by {track['artist']}..."
+    pending = [
+        i
+        for i, track in enumerate(merged_track_list)
+        if "apple_music" not in track and "spotify" in track
+    ]
+    journal = TrackJournal(merged_track_list, track_list_path)
+    review_queue = (
+        ReviewQueue(get_sidecar_path(track_list_path, "review"))
+        if ctx.obj["defer_review"]
+        else None
+    )
+    try:
+        pending = resolve_by_isrc(
+            apple_music_api,
+            merged_track_list,
+            pending,
+            ctx.obj["concurrency"],
+            journal,
+        )
+        # Tracks with the same normalized title, artist and album share one search
+        coalescer = SearchCoalescer(merged_track_list, ctx.obj["metrics"])
+        for index, search_result in coalescer.search(
+            search, pending, ctx.obj["concurrency"]
+        ):
+            if review_queue is not None:
+                search_result = review_queue.defer(
+                    "spotify", merged_track_list[index], search_result
+                )
+            merged_track_list[index]["apple_music"] = search_result
+            journal.record(index)
+            ctx.obj["metrics"].record_match(
+                search_result and search_result.get("match_type")
             )
-            isrc = track["spotify"]["isrc"]
-            try:
-                search_result = apple_music_api.search_track_by_isrc(isrc)
-                if search_result is None:
-                    print("Searching by title and artist instead...")
-                    search_result = apple_music_api.search_track_from_text(
-                        track["title"], track["artist"], track["album"], False
-                    )
-                    (
-                        print("Could not be found")
-                        if search_result is None
-                        else print("Found")
-                    )
-                track["apple_music"] = search_result
-            except UnauthorizedRequestException as e:
-                print(f"Error: {e}")
-                break
+        if coalescer.avoided:
+            print(f"Reused results for {coalescer.avoided} duplicate tracks")
+    except (UnauthorizedRequestException, RateLimitExceededException) as e:
+        print(f"Error: {e}")
+    except KeyboardInterrupt:
+        print("\nProcess interrupted.")
+    finally:
+        journal.compact()
+        journal.close()
+        if review_queue is not None:
+            review_queue.close()
+            if review_queue.count:
+                print(f"Queued {review_queue.count} tracks for review")
+        report_metrics(ctx)
+        close_apple_music_api(apple_music_api)
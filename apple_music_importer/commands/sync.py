@@ -1,9 +1,154 @@
 import json
+import time
 import typer
 from pathlib import Path
-from apple_music_importer.api.apple_music import AppleMusicAPI
-from apple_music_importer.utils import load_track_list
-from apple_music_importer.session import SessionHandler
+from apple_music_importer.api.apple_music import (
+    LIBRARY_ADD_BATCH_SIZE,
+    PLAYLIST_BATCH_SIZE,
+    AppleMusicAPI,
+)
+from apple_music_importer.commands.common import (
+    close_apple_music_api,
+    create_apple_music_api,
+    report_metrics,
+)
+from apple_music_importer.concurrency import map_in_order
+from apple_music_importer.library import LibrarySnapshot
+from apple_music_importer.session import (
+    RateLimitExceededException,
+    UnauthorizedRequestException,
+)
+from apple_music_importer.utils import (
+    atomic_write_text,
+    get_sidecar_path,
+    load_track_list,
+)
+
+
+# Number of library songs deleted per checkpointed batch
+DELETE_BATCH_SIZE = 20
+
+
+class SyncCheckpoint:
+    """Catalog IDs already committed by sync, so interrupted runs can resume."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.state = {"committed": {}, "playlists": {}}
+        if path.exists():
+            self.state = json.loads(path.read_text())
+
+    def committed(self, name: str) -> set:
+        return set(self.state["committed"].get(name, []))
+
+    def mark_committed(self, name: str, music_id_list: list) -> None:
+        self.state["committed"].setdefault(name, []).extend(music_id_list)
+        self.save()
+
+    def get_playlist_id(self, source: str):
+        return self.state["playlists"].get(source)
+
+    def set_playlist_id(self, source: str, playlist_id: str) -> None:
+        self.state["playlists"][source] = playlist_id
+        self.save()
+
+    def save(self) -> None:
+        atomic_write_text(self.path, json.dumps(self.state))
+
+
+def _get_catalog_id(track: dict):
+    """Return the Apple Music catalog ID of a track, if it was found."""
+    apple_music = track.get("apple_music")
+    if not isinstance(apple_music, dict):
+        return None
+    return apple_music.get("response", apple_music).get("id")
+
+
+def _send_batches(
+    name: str,
+    music_id_list: list,
+    send,
+    checkpoint: SyncCheckpoint,
+    batch_size: int,
+    workers: int,
+) -> None:
+    """Send uncommitted IDs in batches, checkpointing each committed batch."""
+    committed = checkpoint.committed(name)
+    pending = [music_id for music_id in music_id_list if music_id not in committed]
+    if len(pending) < len(music_id_list):
+        print(f"{name}: skipping {len(music_id_list) - len(pending)} committed tracks")
+    batches = [
+        pending[start : start + batch_size]
+        for start in range(0, len(pending), batch_size)
+    ]
+
+    def send_batch(batch):
+        started_at = time.monotonic()
+        try:
+            send(batch)
+            return None, time.monotonic() - started_at
+        except (UnauthorizedRequestException, RateLimitExceededException):
+            raise
+        except Exception as e:
+            return e, time.monotonic() - started_at
+
+    failures = 0
+    for i, (batch, (error, elapsed)) in enumerate(
+        map_in_order(send_batch, batches, workers), 1
+    ):
+        if error is not None:
+            failures += 1
+            print(f"{name}: batch {i}/{len(batches)} failed after {elapsed:.2f}s: {error}")
+            continue
+        checkpoint.mark_committed(name, batch)
+        print(
+            f"{name}: batch {i}/{len(batches)} ({len(batch)} tracks) committed in {elapsed:.2f}s"
+        )
+    print(
+        f"{name}: {len(batches) - failures}/{len(batches)} batches committed"
+        + (f", {failures} failed (re-run to retry)" if failures else "")
+    )
+
+
+def _delete_uploaded_tracks(
+    apple_music_api: AppleMusicAPI,
+    library: LibrarySnapshot,
+    checkpoint: SyncCheckpoint,
+    workers: int,
+    dry_run: bool,
+):
+    """Delete the uploaded (non-catalog) songs in the library."""
+    name = "delete:uploaded"
+    library_song_ids = library.get_uploaded_song_ids()
+    deleted = checkpoint.committed(name)
+    pending = [song_id for song_id in library_song_ids if song_id not in deleted]
+    print(f"Found {len(pending)} uploaded songs to delete")
+    if dry_run:
+        for song_id in pending:
+            song = library.songs[song_id]
+            print(f"Would delete {song['name']} by {song['artist']} ({song_id})")
+        return
+    if not pending or not typer.confirm(
+        f"Delete {len(pending)} uploaded songs from the library?"
+    ):
+        return
+
+    def delete_batch(batch):
+        for song_id in batch:
+            apple_music_api.delete_library_song(song_id)
+
+    try:
+        _send_batches(
+            name,
+            pending,
+            delete_batch,
+            checkpoint,
+            DELETE_BATCH_SIZE,
+            workers,
+        )
+    finally:
+        library.remove(checkpoint.committed(name))
+        library.save()
 
 
 def _add_tracks(
@@ -12,25 +157,56 @@ def _add_tracks(
     apple_music_api: AppleMusicAPI,
     add_to_library: bool,
     create_playlist: bool,
+    checkpoint: SyncCheckpoint,
+    library: LibrarySnapshot,
+    workers: int,
 ):
     """Add tracks from a specified source to Apple Music."""
     song_list = list(filter(lambda track: source in track, track_list))
     song_list.sort(key=lambda track: track[source]["date_added"])
-    music_id_list = [
-        track["apple_music"]["response"]["id"]
-        for track in song_list
-        if "apple_music" in track
-        and "response" in track["apple_music"]
-        and "id" in track["apple_music"]["response"]
-    ]
+    music_id_list = list(
+        dict.fromkeys(
+            music_id
+            for music_id in map(_get_catalog_id, song_list)
+            if music_id is not None
+        )
+    )
     if add_to_library:
-        response = apple_music_api.add_tracks_to_library(music_id_list)
-        print(f"Successfully added {len(music_id_list)} tracks to the library")
+        missing_id_list = [
+            music_id
+            for music_id in music_id_list
+            if music_id not in library.catalog_ids
+        ]
+        print(
+            f"{len(music_id_list) - len(missing_id_list)} of {len(music_id_list)} "
+            f"{source} tracks are already in the library"
+        )
+        _send_batches(
+            f"library:{source}",
+            missing_id_list,
+            apple_music_api.add_tracks_to_library,
+            checkpoint,
+            LIBRARY_ADD_BATCH_SIZE,
+            workers,
+        )
+        library.catalog_ids.update(checkpoint.committed(f"library:{source}"))
     if create_playlist:
-        apple_music_api.create_playlist(
-            f"Imported from {source.capitalize()}", music_id_list
+        name = f"Imported from {source.capitalize()}"
+        playlist_id = checkpoint.get_playlist_id(source)
+        if playlist_id is None:
+            response = apple_music_api.create_playlist(name)
+            playlist_id = response["data"][0]["id"]
+            checkpoint.set_playlist_id(source, playlist_id)
+            print(f'Successfully created playlist "{name}"')
+        # Batches are appended one at a time to keep the playlist in order
+        _send_batches(
+            f"playlist:{source}",
+            music_id_list,
+            lambda batch: apple_music_api.add_tracks_to_playlist(playlist_id, batch),
+            checkpoint,
+            PLAYLIST_BATCH_SIZE,
+            1,
         )
-        print(f'Successfully created playlist "Imported from {source.capitalize()}"')
 
 
 def sync(
@@ -60,6 +236,21 @@ def sync(
         "--add-to-library",
         help="Add the synced tracks to the Apple Music Library",
     ),
+    refresh_library: bool = typer.Option(
+        False,
+        "--refresh-library",
+        help="Fetch the whole library instead of only songs added since the last snapshot",
+    ),
+    dry_run: bool = typer.Option(
+        False,
+        "--dry-run",
+        help="List the songs --delete-all-tracks would delete without deleting them",
+    ),
+    reset_checkpoint: bool = typer.Option(
+        False,
+        "--reset-checkpoint",
+        help="Forget which tracks previous syncs committed and start over",
+    ),
 ):
     """
     Sync tracks from Spotify and local files with Apple Music.
@@ -69,26 +260,55 @@ def sync(
     track_list_path = ctx.obj["track_list"] or Path("tracks.list")
     track_list = load_track_list(track_list_path)
 
-    request_headers = json.loads(ctx.obj["request_headers"].read_text())
-    session_handler = SessionHandler(request_headers)
+    apple_music_api = create_apple_music_api(ctx)
+    checkpoint_path = get_sidecar_path(track_list_path, "sync")
+    if reset_checkpoint:
+        checkpoint_path.unlink(missing_ok=True)
+    checkpoint = SyncCheckpoint(checkpoint_path)
 
-    apple_music_api = AppleMusicAPI(
-        session_handler,
-        ctx.obj["country_code"],
-        ctx.obj["limit"],
-    )
+    try:
+        # First, get the contents of the library from Apple Music
+        library = LibrarySnapshot(get_sidecar_path(track_list_path, "library"))
+        if add_to_library or delete_all_tracks:
+            # Uploaded songs can only be found reliably in a complete snapshot
+            library.refresh(
+                apple_music_api,
+                refresh_library or delete_all_tracks,
+                ctx.obj["concurrency"],
+            )
+            library.save()
 
-    # First, get the contents of the library from Apple Music
-    # TODO: Implement this
+        if delete_all_tracks:
+            _delete_uploaded_tracks(
+                apple_music_api, library, checkpoint, ctx.obj["concurrency"], dry_run
+            )
 
-    # Second, add tracks from Spotify
-    if sync_spotify:
-        _add_tracks(
-            "spotify", track_list, apple_music_api, add_to_library, create_playlist
-        )
+        # Second, add tracks from Spotify
+        if sync_spotify:
+            _add_tracks(
+                "spotify",
+                track_list,
+                apple_music_api,
+                add_to_library,
+                create_playlist,
+                checkpoint,
+                library,
+                ctx.obj["concurrency"],
+            )
 
-    # Third, add tracks from local files
-    if sync_local:
-        _add_tracks(
-            "local", track_list, apple_music_api, add_to_library, create_playlist
-        )
+        # Third, add tracks from local files
+        if sync_local:
+            _add_tracks(
+                "local",
+                track_list,
+                apple_music_api,
+                add_to_library,
+                create_playlist,
+                checkpoint,
+                library,
+                ctx.obj["concurrency"],
+            )
+
+    finally:
+        report_metrics(ctx)
+        close_apple_music_api(apple_music_api)
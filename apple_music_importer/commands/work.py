@@ -0,0 +1,178 @@
+import typer
+from pathlib import Path
+from typing import Annotated, Optional
+from apple_music_importer.commands.common import (
+    close_apple_music_api,
+    SearchCoalescer,
+    create_apple_music_api,
+    ensure_no_active_workers,
+    report_metrics,
+    resolve_by_isrc,
+    search_track,
+)
+from apple_music_importer.review_queue import ReviewQueue
+from apple_music_importer.session import (
+    RateLimitExceededException,
+    UnauthorizedRequestException,
+)
+from apple_music_importer.shard import LeaseDirectory, get_default_worker_id
+from apple_music_importer.utils import (
+    TrackJournal,
+    get_sidecar_path,
+    get_worker_journal_paths,
+    load_track_list,
+    save_track_list,
+)
+
+
+def _get_source(track: dict) -> Optional[str]:
+    """Return the source whose tags a track is searched with."""
+    for source in ("local", "spotify"):
+        if isinstance(track.get(source), dict):
+            return source
+    return None
+
+
+def _is_pending(track: dict) -> bool:
+    return "apple_music" not in track and _get_source(track) is not None
+
+
+def _merge_results(track_list_path: Path) -> None:
+    """Write the results of every worker into the track list and clean up."""
+    ensure_no_active_workers(track_list_path)
+    worker_journal_paths = get_worker_journal_paths(track_list_path)
+    track_list = load_track_list(track_list_path)
+    # Saving removes the worker journals
+    save_track_list(track_list, track_list_path)
+    print(f"Merged the results of {len(worker_journal_paths)} workers")
+
+
+def work(
+    ctx: typer.Context,
+    worker_id: Annotated[
+        Optional[str],
+        typer.Option(
+            help="ID of this worker, unique among the workers sharing the track list (default: <host>-<pid>)",
+        ),
+    ] = None,
+    chunk_size: Annotated[
+        int,
+        typer.Option(
+            help="Number of consecutive tracks claimed by a worker at once",
+            min=1,
+        ),
+    ] = 200,
+    lease_ttl: Annotated[
+        float,
+        typer.Option(
+            help="Seconds after which the claim of a worker that stopped renewing it expires",
+            min=10,
+        ),
+    ] = 600.0,
+    merge: Annotated[
+        bool,
+        typer.Option(
+            help="Merge the results of all finished workers into the track list",
+        ),
+    ] = False,
+):
+    """
+    Search pending tracks as one of several workers sharing a track list.
+    """
+    track_list_path = ctx.obj["track_list"] or Path("tracks.list")
+    worker_id = (worker_id or get_default_worker_id()).replace("/", "_")
+    leases = LeaseDirectory(
+        get_sidecar_path(track_list_path, "leases"), worker_id, lease_ttl
+    )
+    if merge:
+        _merge_results(track_list_path)
+        return
+
+    # Workers only append to their own journal; the track list stays untouched
+    track_list = load_track_list(track_list_path)
+    if not any(_is_pending(track) for track in track_list):
+        print("No pending tracks in the track list")
+        return
+    apple_music_api = create_apple_music_api(ctx)
+    journal = TrackJournal(track_list, track_list_path, worker_id)
+    review_queue = (
+        ReviewQueue(get_sidecar_path(track_list_path, "review"))
+        if ctx.obj["defer_review"]
+        else None
+    )
+    coalescer = SearchCoalescer(track_list, ctx.obj["metrics"])
+    chunk = None
+
+    def search(index):
+        leases.renew(chunk)
+        track = track_list[index]
+        print(
+            f"[{worker_id}] Searching track {index + 1}/{len(track_list)}: {track['title']} by {track['artist']}..."
+        )
+        return search_track(
+            apple_music_api,
+            track,
+            _get_source(track),
+            return_weak=review_queue is not None,
+        )
+
+    print(f"Worker {worker_id} searching {track_list_path}...")
+    claimed = 0
+    try:
+        for chunk in range(0, (len(track_list) + chunk_size - 1) // chunk_size):
+            start = chunk * chunk_size
+            end = min(start + chunk_size, len(track_list))
+            pending = [i for i in range(start, end) if _is_pending(track_list[i])]
+            if not pending or not leases.claim(chunk):
+                continue
+            claimed += 1
+            print(
+                f"[{worker_id}] Claimed tracks {start + 1}-{end} ({len(pending)} pending)"
+            )
+
+            isrc_pending = {
+                i for i in pending if (track_list[i].get("spotify") or {}).get("isrc")
+            }
+            if isrc_pending:
+                misses = set(
+                    resolve_by_isrc(
+                        apple_music_api,
+                        track_list,
+                        sorted(isrc_pending),
+                        ctx.obj["concurrency"],
+                        journal,
+                    )
+                )
+                pending = [i for i in pending if i in misses or i not in isrc_pending]
+
+            for index, search_result in coalescer.search(
+                search, pending, ctx.obj["concurrency"]
+            ):
+                if review_queue is not None:
+                    search_result = review_queue.defer(
+                        _get_source(track_list[index]),
+                        track_list[index],
+                        search_result,
+                    )
+                track_list[index]["apple_music"] = search_result
+                journal.record(index)
+                ctx.obj["metrics"].record_match(
+                    search_result and search_result.get("match_type")
+                )
+            leases.finish(chunk)
+        print(
+            f"[{worker_id}] No ranges left to claim after {claimed} ranges; "
+            "run 'work --merge' once every worker has finished"
+        )
+    except (UnauthorizedRequestException, RateLimitExceededException) as e:
+        print(f"Error: {e}")
+    except KeyboardInterrupt:
+        print("\nProcess interrupted.")
+    finally:
+        journal.close()
+        if review_queue is not None:
+            review_queue.close()
+            if review_queue.count:
+                print(f"Queued {review_queue.count} tracks for review")
+        report_metrics(ctx)
+        close_apple_music_api(apple_music_api)
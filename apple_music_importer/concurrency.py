@@ -0,0 +1,106 @@
+import itertools
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# Serializes interactive prompts issued from worker threads
+prompt_lock = threading.Lock()
+
+
+def map_in_order(
+    func, items, workers=1, executor_class=ThreadPoolExecutor, max_in_flight=None
+):
+    """
+    Apply func to every item using up to `workers` threads (or processes).
+
+    At most `max_in_flight` items (default `workers * 2`) are submitted at
+    once, and (item, result) pairs are yielded in input order regardless of
+    completion order. Items are only pulled from `items` as capacity frees
+    up, so it may be a lazy iterator.
+    """
+    if workers <= 1:
+        for item in items:
+            yield item, func(item)
+        return
+
+    executor = executor_class(max_workers=workers)
+    iterator = iter(items)
+    pending = deque(
+        (item, executor.submit(func, item))
+        for item in itertools.islice(iterator, max_in_flight or workers * 2)
+    )
+    try:
+        while pending:
+            item, future = pending.popleft()
+            result = future.result()
+            for next_item in itertools.islice(iterator, 1):
+                pending.append((next_item, executor.submit(func, next_item)))
+            yield item, result
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def prefetch_batches(iterable, maxsize, batch_size):
+    """
+    Run an iterator in a background thread, buffering up to `maxsize` items.
+
+    The thread starts immediately. The returned generator yields lists of
+    up to `batch_size` items holding whatever is buffered at the time, so
+    the first items arrive without waiting for a batch to fill up.
+    Exceptions raised by the iterator are re-raised in the consuming thread.
+    """
+    buffer = queue.Queue(maxsize)
+    stop = threading.Event()
+    done = object()
+
+    def put(entry):
+        while not stop.is_set():
+            try:
+                buffer.put(entry, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        iterator = iter(iterable)
+        try:
+            for item in iterator:
+                if not put((item, None)):
+                    return
+            put((done, None))
+        except BaseException as e:
+            put((done, e))
+        finally:
+            close = getattr(iterator, "close", None)
+            if close is not None:
+                close()
+
+    def consume():
+        try:
+            while True:
+                batch = []
+                entry = buffer.get()
+                while True:
+                    item, error = entry
+                    if item is done:
+                        if batch:
+                            yield batch
+                        if error is not None:
+                            raise error
+                        return
+                    batch.append(item)
+                    if len(batch) >= batch_size:
+                        break
+                    try:
+                        entry = buffer.get_nowait()
+                    except queue.Empty:
+                        break
+                yield batch
+        finally:
+            stop.set()
+
+    # Start producing right away, before the first batch is requested
+    threading.Thread(target=produce, daemon=True).start()
+    return consume()
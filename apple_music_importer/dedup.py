@@ -0,0 +1,86 @@
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from apple_music_importer.concurrency import map_in_order
+from apple_music_importer.id3 import get_audio_range
+from apple_music_importer.scan_index import ScanIndex
+
+# Size of the reads while hashing audio data
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def hash_audio_file(file_path: str) -> str:
+    """
+    Return a hash of the audio data of a file, ignoring its ID3 tags, so
+    that copies with edited tags still have the same hash.
+    """
+    start, end = get_audio_range(file_path)
+    digest = hashlib.blake2b(digest_size=16)
+    buffer = bytearray(HASH_CHUNK_SIZE)
+    view = memoryview(buffer)
+    with open(file_path, "rb") as file:
+        file.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            count = file.readinto(view[: min(remaining, HASH_CHUNK_SIZE)])
+            if not count:
+                break
+            digest.update(view[:count])
+            remaining -= count
+    return digest.hexdigest()
+
+
+class Deduplicator:
+    """
+    Find local files with the same audio data as a file seen before.
+
+    Files are hashed by a pool of threads (hashing and reading release the
+    GIL), and the hash of a file is kept in the scan index, so it is only
+    computed again once the size or modification time of the file changes.
+    `primary_by_hash` maps the hashes of known tracks to their paths; the
+    first new file with an unknown hash becomes the primary file of that
+    hash.
+    """
+
+    def __init__(
+        self,
+        scan_index: ScanIndex,
+        primary_by_hash: dict,
+        primary_paths: set,
+        workers: int = 4,
+    ):
+        self.scan_index = scan_index
+        self.primary_by_hash = primary_by_hash
+        self.primary_paths = primary_paths
+        self.workers = workers
+        self.hashed = 0
+
+    def _hash(self, item):
+        file, (size, mtime), changed = item
+        content_hash = self.scan_index.get_hash(file, size, mtime)
+        if content_hash is None:
+            try:
+                content_hash = hash_audio_file(file)
+            except OSError as e:
+                print(f"Error reading {file}: {e}")
+                return None
+            self.hashed += 1
+        return content_hash
+
+    def iter_hashed(self, items):
+        """
+        Yield (path, (size, mtime), changed, hash, primary path) for
+        (path, (size, mtime), changed) items, where the primary path is set
+        if a changed file has the same audio data as another track.
+
+        Files of known tracks are never reported as duplicates, only used
+        as primary files of their hashes.
+        """
+        for (file, stat, changed), content_hash in map_in_order(
+            self._hash, items, self.workers, ThreadPoolExecutor
+        ):
+            primary = None
+            if content_hash is not None:
+                primary = self.primary_by_hash.setdefault(content_hash, file)
+                if primary == file or file in self.primary_paths:
+                    primary = None
+            yield file, stat, changed, content_hash, primary
@@ -0,0 +1,138 @@
+import os
+
+# Frame IDs for title, artist, album and length in ID3v2.2 and ID3v2.3/2.4
+_FRAME_IDS = {
+    2: {"TT2": "title", "TP1": "artist", "TAL": "album", "TLE": "length"},
+    3: {"TIT2": "title", "TPE1": "artist", "TALB": "album", "TLEN": "length"},
+    4: {"TIT2": "title", "TPE1": "artist", "TALB": "album", "TLEN": "length"},
+}
+_TEXT_ENCODINGS = {0: "latin-1", 1: "utf-16", 2: "utf-16-be", 3: "utf-8"}
+
+
+def _syncsafe(data: bytes) -> int:
+    return (data[0] << 21) | (data[1] << 14) | (data[2] << 7) | data[3]
+
+
+def _unsynchronize(data: bytes) -> bytes:
+    return data.replace(b"\xff\x00", b"\xff")
+
+
+def _decode_text_frame(data: bytes) -> str:
+    """Decode the first value of an ID3v2 text frame."""
+    if not data:
+        return ""
+    encoding = _TEXT_ENCODINGS.get(data[0], "latin-1")
+    text = data[1:].decode(encoding, errors="replace")
+    return text.split("\x00")[0].strip()
+
+
+def _read_id3v2(file) -> dict:
+    header = file.read(10)
+    if len(header) < 10 or header[:3] != b"ID3":
+        return {}
+    version, flags, size = header[3], header[5], _syncsafe(header[6:10])
+    frame_ids = _FRAME_IDS.get(version)
+    if frame_ids is None:
+        return {}
+    data = file.read(size)
+    if version < 4 and flags & 0x80:
+        data = _unsynchronize(data)
+
+    position = 0
+    if flags & 0x40:  # Extended header
+        if version == 3:
+            position = 4 + int.from_bytes(data[:4], "big")
+        elif version == 4:
+            position = _syncsafe(data[:4])
+
+    id_length, header_length = (3, 6) if version == 2 else (4, 10)
+    tags = {}
+    while position + header_length <= len(data) and len(tags) < len(frame_ids):
+        frame_id = data[position : position + id_length]
+        if not frame_id.strip(b"\x00"):
+            break  # Padding
+        size_bytes = data[position + id_length : position + id_length * 2]
+        if version == 2:
+            frame_size = int.from_bytes(size_bytes, "big")
+            frame_flags = 0
+        elif version == 3:
+            frame_size = int.from_bytes(size_bytes, "big")
+            frame_flags = int.from_bytes(data[position + 8 : position + 10], "big")
+        else:
+            frame_size = _syncsafe(size_bytes)
+            frame_flags = int.from_bytes(data[position + 8 : position + 10], "big")
+        body = data[position + header_length : position + header_length + frame_size]
+        position += header_length + frame_size
+
+        key = frame_ids.get(frame_id.decode("latin-1"))
+        if key is None:
+            continue
+        if version == 3 and frame_flags & 0x00C0:
+            continue  # Compressed or encrypted
+        if version == 4:
+            if frame_flags & 0x000C:
+                continue  # Compressed or encrypted
+            if frame_flags & 0x0001:
+                body = body[4:]  # Data length indicator
+            if frame_flags & 0x0002:
+                body = _unsynchronize(body)
+        value = _decode_text_frame(body)
+        if value:
+            tags[key] = value
+    return tags
+
+
+def _read_id3v1(file) -> dict:
+    file.seek(0, os.SEEK_END)
+    if file.tell() < 128:
+        return {}
+    file.seek(-128, os.SEEK_END)
+    data = file.read(128)
+    if data[:3] != b"TAG":
+        return {}
+    tags = {}
+    for key, start in (("title", 3), ("artist", 33), ("album", 63)):
+        value = data[start : start + 30].split(b"\x00")[0]
+        value = value.decode("latin-1").strip()
+        if value:
+            tags[key] = value
+    return tags
+
+
+def read_tags(file_path: str) -> dict:
+    """
+    Read title, artist, album and length (TLEN, in milliseconds) from the
+    ID3 tags of a file.
+
+    Only the ID3v2 tag at the start of the file and the ID3v1 tag at its end
+    are read; ID3v2 values take precedence. Missing values are left out.
+    """
+    with open(file_path, "rb") as file:
+        tags = _read_id3v2(file)
+        if not all(key in tags for key in ("title", "artist", "album")):
+            tags = {**_read_id3v1(file), **tags}
+    return tags
+
+
+def get_audio_range(file_path: str) -> tuple:
+    """
+    Return the start and end offsets of the audio data of a file, i.e. the
+    file without the ID3v2 tags at its start and the ID3v1 tag at its end.
+    """
+    with open(file_path, "rb") as file:
+        file.seek(0, os.SEEK_END)
+        end = file.tell()
+        start = 0
+        while True:
+            file.seek(start)
+            header = file.read(10)
+            if len(header) < 10 or header[:3] != b"ID3":
+                break
+            start += 10 + _syncsafe(header[6:10])
+            if header[5] & 0x10:  # Footer
+                start += 10
+        if end - start >= 128:
+            file.seek(end - 128)
+            if file.read(3) == b"TAG":
+                end -= 128
+    return min(start, end), end
@@ -0,0 +1,88 @@
+import json
+from datetime import datetime
+from pathlib import Path
+from apple_music_importer.api.apple_music import AppleMusicAPI
+from apple_music_importer.utils import atomic_write_text
+
+
+def _get_catalog_id(library_song: dict):
+    """Return the catalog ID of a library song, or None for uploaded songs."""
+    play_params = library_song.get("attributes", {}).get("playParams", {})
+    if play_params.get("catalogId"):
+        return play_params["catalogId"]
+    catalog = library_song.get("relationships", {}).get("catalog", {}).get("data", [])
+    return catalog[0]["id"] if catalog else None
+
+
+class LibrarySnapshot:
+    """
+    Local index of the songs in the Apple Music library.
+
+    Songs are keyed by library song ID. Refreshes only fetch songs added
+    since the previous snapshot unless a full refresh is requested.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.songs = {}
+        self.updated_at = None
+        if path.exists():
+            state = json.loads(path.read_text())
+            self.songs = state["songs"]
+            self.updated_at = state["updated_at"]
+        self.catalog_ids = self._collect_catalog_ids()
+
+    def _collect_catalog_ids(self) -> set:
+        return {
+            song["catalog_id"] for song in self.songs.values() if song["catalog_id"]
+        }
+
+    def refresh(self, apple_music_api: AppleMusicAPI, full=False, workers=1) -> None:
+        """Fetch the library contents, incrementally if a snapshot exists."""
+        incremental = bool(self.songs) and not full
+        print(
+            "Refreshing library snapshot..."
+            if incremental
+            else "Fetching the whole library..."
+        )
+        library_songs = apple_music_api.get_my_library(
+            set(self.songs) if incremental else None, workers
+        )
+        if not incremental:
+            self.songs = {}
+        added = 0
+        for library_song in library_songs:
+            if library_song["id"] not in self.songs:
+                added += 1
+            attributes = library_song.get("attributes", {})
+            self.songs[library_song["id"]] = {
+                "catalog_id": _get_catalog_id(library_song),
+                "name": attributes.get("name", ""),
+                "artist": attributes.get("artistName", ""),
+                "date_added": attributes.get("dateAdded", ""),
+            }
+        self.updated_at = datetime.now().isoformat()
+        self.catalog_ids = self._collect_catalog_ids()
+        print(f"Library has {len(self.songs)} songs ({added} new since last snapshot)")
+
+    def get_uploaded_song_ids(self) -> list:
+        """Return the IDs of library songs that are not in the catalog."""
+        return [
+            library_song_id
+            for library_song_id, song in self.songs.items()
+            if not song["catalog_id"]
+        ]
+
+    def remove(self, library_song_ids) -> None:
+        for library_song_id in library_song_ids:
+            self.songs.pop(library_song_id, None)
+        self.catalog_ids = self._collect_catalog_ids()
+
+    def save(self) -> None:
+        atomic_write_text(
+            self.path,
+            json.dumps(
+                {"updated_at": self.updated_at, "songs": self.songs},
+                ensure_ascii=False,
+            ),
+        )
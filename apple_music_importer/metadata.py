@@ -1,16 +1,53 @@
 import os
 import re
 import eyed3
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
+from enum import Enum
+from functools import partial
+from apple_music_importer.concurrency import map_in_order
+from apple_music_importer.id3 import read_tags
 from apple_music_importer.utils import normalize
 
 eyed3.log.setLevel("ERROR")
 
+# Number of files between progress messages while reading tags
+PROGRESS_INTERVAL = 1000
+
+
+class TagReader(str, Enum):
+    eyed3 = "eyed3"
+    fast = "fast"
+
+
+def _load_tags(file_path, tag_reader):
+    """
+    Return the title, artist and album tags and the duration in milliseconds
+    of a file (None if missing).
+
+    The fast reader only knows the duration if the file has a TLEN frame.
+    """
+    if tag_reader == TagReader.fast:
+        tags = read_tags(file_path)
+        if not tags:
+            raise ValueError("No metadata found")
+        length = tags.get("length", "")
+        duration_ms = int(length) if length.isdigit() else None
+        return tags.get("title"), tags.get("artist"), tags.get("album"), duration_ms
+
+    file = eyed3.load(file_path)
+    if not file or not file.tag:
+        raise ValueError("No metadata found")
+    duration_ms = round(file.info.time_secs * 1000) if file.info else None
+    return file.tag.title, file.tag.artist, file.tag.album, duration_ms
+
 
 class MetadataHandler:
     @staticmethod
-    def _get_mp3_metadata(file_path, artist_name_position, album_name_position):
-        """Extract metadata from an MP3 file."""
+    def _get_mp3_metadata(
+        file_path, artist_name_position, album_name_position, tag_reader=TagReader.eyed3
+    ):
+        """Extract title, artist, album and duration (ms, or None) from an MP3 file."""
         parent_dirs = os.path.dirname(file_path).split(os.sep)
         file_basename = os.path.basename(os.path.splitext(file_path)[0])
         clean_file_name = re.sub(
@@ -18,15 +55,16 @@ class MetadataHandler:
         )  # Remove track number
 
         try:
-            file = eyed3.load(file_path)
-            if not file or not file.tag:
-                raise ValueError("No metadata found")
-            track = file.tag.title or clean_file_name
-            artist = file.tag.artist or parent_dirs[artist_name_position]
-            album = file.tag.album or parent_dirs[album_name_position]
+            title_tag, artist_tag, album_tag, duration_ms = _load_tags(
+                file_path, tag_reader
+            )
+            track = title_tag or clean_file_name
+            artist = artist_tag or parent_dirs[artist_name_position]
+            album = album_tag or parent_dirs[album_name_position]
 
         except Exception as e:
             print(f"Error reading {file_path}: {e}")
+            duration_ms = None
             track = clean_file_name
             artist = (
                 parent_dirs[artist_name_position]
@@ -43,40 +81,90 @@ class MetadataHandler:
             normalize(track),
             normalize(artist),
             normalize(album),
+            duration_ms,
+        )
+
+    @staticmethod
+    def get_track_info(
+        file, artist_name_position, album_name_position, tag_reader=TagReader.eyed3
+    ):
+        """Build the track dictionary for a single MP3 file (None on failure)."""
+        try:
+            filename = os.path.basename(file)
+            track, artist, album, duration_ms = MetadataHandler._get_mp3_metadata(
+                file, artist_name_position, album_name_position, tag_reader
+            )
+            date_added = datetime.fromtimestamp(os.path.getctime(file)).isoformat()
+
+            return {
+                "title": track,
+                "artist": artist,
+                "album": album,
+                "local": {
+                    "path": file,
+                    "filename": filename,
+                    "date_added": date_added,
+                    "duration_ms": duration_ms,
+                },
+            }
+        except Exception as e:
+            print(f"Error reading {file}: {e}")
+            return None
+
+    @staticmethod
+    def iter_track_info(
+        paths,
+        artist_name_position,
+        album_name_position,
+        tag_reader=TagReader.eyed3,
+        workers=1,
+    ):
+        """
+        Yield (path, track dictionary or None) for MP3 files as they are read.
+
+        `paths` may be a lazy iterator; only a bounded number of files is
+        being read at any time.
+        """
+        get_track_info = partial(
+            MetadataHandler.get_track_info,
+            artist_name_position=artist_name_position,
+            album_name_position=album_name_position,
+            tag_reader=tag_reader,
         )
+        for i, (path, track_info) in enumerate(
+            map_in_order(
+                get_track_info,
+                paths,
+                workers,
+                ProcessPoolExecutor,
+                max_in_flight=workers * 16,
+            ),
+            1,
+        ):
+            if i % PROGRESS_INTERVAL == 0:
+                print(f"Processed audio tags of {i} files...")
+            yield path, track_info
 
     @staticmethod
-    def get_track_list_from_files(paths, artist_name_position, album_name_position):
+    def get_track_list_from_files(
+        paths,
+        artist_name_position,
+        album_name_position,
+        tag_reader=TagReader.eyed3,
+        workers=1,
+    ):
         """Build track dictionary from MP3 files in the given paths."""
-        tracks = []
-        for i, file in enumerate(paths):
-            try:
-                print(f"Processing audio tags: {i+1}/{len(paths)}...")
-                filename = os.path.basename(file)
-                track, artist, album = MetadataHandler._get_mp3_metadata(
-                    file, artist_name_position, album_name_position
-                )
-                date_added = datetime.fromtimestamp(os.path.getctime(file)).isoformat()
-
-                track_info = {
-                    "title": track,
-                    "artist": artist,
-                    "album": album,
-                    "local": {
-                        "path": file,
-                        "filename": filename,
-                        "date_added": date_added,
-                    },
-                }
-                tracks.append(track_info)
-            except Exception as e:
-                print(f"Error reading {file}: {e}")
-                continue
-        return tracks
+        return [
+            track_info
+            for _, track_info in MetadataHandler.iter_track_info(
+                paths, artist_name_position, album_name_position, tag_reader, workers
+            )
+            if track_info is not None
+        ]
 
     @staticmethod
     def save_metadata_to_mp3(file_path, title, artist, album):
-        """Save metadata to an MP3 file with UTF-8 encoding."""
+        """Save metadata to an MP3 file with UTF-8 encoding; return whether it worked."""
         try:
             file = eyed3.load(file_path)
             file.tag.title = title
@@ -84,5 +172,7 @@ class MetadataHandler:
             file.tag.album = album
             file.tag.save(version=eyed3.id3.ID3_DEFAULT_VERSION, encoding="utf-8")
             print(f"Metadata saved to {file_path}")
+            return True
         except Exception as e:
             print(f"Error saving metadata to {file_path}: {e}")
+            return False
@@ -0,0 +1,211 @@
+import cProfile
+import json
+import threading
+import time
+import urllib.parse
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+
+
+def get_endpoint_name(method: str, url: str) -> str:
+    """
+    Return the endpoint of a request URL with IDs and storefront left out.
+
+    e.g. "GET /catalog/search" or "POST /me/library/playlists/:id/tracks".
+    """
+    parts = [part for part in urllib.parse.urlsplit(url).path.split("/") if part]
+    if parts and parts[0] == "v1":
+        parts = parts[1:]
+    if parts[:1] == ["catalog"]:
+        parts = parts[:1] + parts[2:]  # Drop the storefront
+    parts = [
+        ":id" if any(c.isdigit() for c in part) or "." in part else part
+        for part in parts
+    ]
+    return f"{method} /{'/'.join(parts)}"
+
+
+class Metrics:
+    """
+    Counters and timings of an import run, shared by every worker thread.
+
+    Network time is the time spent waiting on responses, wait time the time
+    spent held back by the rate limiter (including pauses after 429/403
+    responses) and backoff time the sleeps before retrying failed
+    connections. If `profile_dir` is set, the profiled phases are recorded
+    with cProfile and written there as `<phase>.prof`.
+    """
+
+    def __init__(self, profile_dir: Path = None):
+        self.lock = threading.Lock()
+        self.started_at = time.monotonic()
+        self.requests = Counter()
+        self.statuses = Counter()
+        self.retries = 0
+        self.connection_errors = 0
+        self.bytes_received = 0
+        self.network_time = 0.0
+        self.wait_time = 0.0
+        self.backoff_time = 0.0
+        self.cache = Counter()
+        self.matches = Counter()
+        self.coalesced = 0
+        self.phases = defaultdict(float)
+        self.profile_dir = profile_dir
+        self.profilers = {}
+
+    def record_request(self, endpoint: str, status: int, size: int, elapsed: float):
+        with self.lock:
+            self.requests[endpoint] += 1
+            self.statuses[status] += 1
+            self.bytes_received += size
+            self.network_time += elapsed
+
+    def record_retry(self):
+        with self.lock:
+            self.retries += 1
+
+    def record_connection_error(self, backoff: float):
+        with self.lock:
+            self.connection_errors += 1
+            self.backoff_time += backoff
+
+    def record_wait(self, seconds: float):
+        with self.lock:
+            self.wait_time += seconds
+
+    def record_cache(self, hit: bool):
+        with self.lock:
+            self.cache["hits" if hit else "misses"] += 1
+
+    def record_match(self, match_type):
+        """Count a search outcome; None means the track was not found."""
+        with self.lock:
+            self.matches[match_type or "not_found"] += 1
+
+    def record_coalesced(self):
+        """Count a search avoided because an identical one was already sent."""
+        with self.lock:
+            self.coalesced += 1
+
+    def _profiler(self, name):
+        if self.profile_dir is None:
+            return None
+        with self.lock:
+            return self.profilers.setdefault(name, cProfile.Profile())
+
+    @contextmanager
+    def phase(self, name: str):
+        """Time (and optionally profile) a block of work under the given phase."""
+        profiler = self._profiler(name)
+        try:
+            if profiler is not None:
+                profiler.enable()
+        except ValueError:
+            profiler = None  # Another profiler is active (Python 3.12+)
+        started_at = time.monotonic()
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - started_at
+            if profiler is not None:
+                profiler.disable()
+            with self.lock:
+                self.phases[name] += elapsed
+
+    def timed_iter(self, name: str, iterable):
+        """Yield from iterable, recording the time spent producing items as a phase."""
+        iterator = iter(iterable)
+        try:
+            while True:
+                with self.phase(name):
+                    try:
+                        item = next(iterator)
+                    except StopIteration:
+                        return
+                yield item
+        finally:
+            close = getattr(iterator, "close", None)
+            if close is not None:
+                close()
+
+    @property
+    def request_count(self):
+        return sum(self.requests.values())
+
+    def summary_line(self) -> str:
+        """Return a one-line summary of the requests sent so far."""
+        count = self.request_count
+        if not count:
+            return "No requests sent"
+        return (
+            f"{count} requests, "
+            f"{self.bytes_received / 1024:.1f} KiB received "
+            f"({self.bytes_received / count / 1024:.1f} KiB/request), "
+            f"average latency {self.network_time / count * 1000:.0f} ms"
+        )
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            return {
+                "elapsed": time.monotonic() - self.started_at,
+                "requests": dict(self.requests),
+                "statuses": {str(status): n for status, n in self.statuses.items()},
+                "throttled": self.statuses[429] + self.statuses[403],
+                "retries": self.retries,
+                "connection_errors": self.connection_errors,
+                "bytes_received": self.bytes_received,
+                "network_time": self.network_time,
+                "wait_time": self.wait_time,
+                "backoff_time": self.backoff_time,
+                "cache": dict(self.cache),
+                "matches": dict(self.matches),
+                "coalesced": self.coalesced,
+                "phases": dict(self.phases),
+            }
+
+    def summary_table(self) -> str:
+        """Return a multi-line report of everything recorded."""
+        report = self.to_dict()
+        rows = [
+            ("Elapsed", f"{report['elapsed']:.1f} s"),
+            ("Requests", str(sum(report["requests"].values()))),
+        ]
+        rows += [
+            (f"  {endpoint}", str(count))
+            for endpoint, count in sorted(report["requests"].items())
+        ]
+        rows += [
+            ("Throttled (429/403)", str(report["throttled"])),
+            ("Retries", str(report["retries"])),
+            ("Connection errors", str(report["connection_errors"])),
+            ("Received", f"{report['bytes_received'] / 1024:.1f} KiB"),
+            ("Network time", f"{report['network_time']:.1f} s"),
+            ("Rate limit wait", f"{report['wait_time']:.1f} s"),
+            ("Retry backoff", f"{report['backoff_time']:.1f} s"),
+            ("Cache hits", str(report["cache"].get("hits", 0))),
+            ("Cache misses", str(report["cache"].get("misses", 0))),
+            ("Searches coalesced", str(report["coalesced"])),
+        ]
+        rows += [
+            (f"Matches ({match_type})", str(count))
+            for match_type, count in sorted(report["matches"].items())
+        ]
+        rows += [
+            (f"Phase {name}", f"{seconds:.1f} s")
+            for name, seconds in sorted(report["phases"].items())
+        ]
+        width = max(len(label) for label, _ in rows)
+        return "\n".join(f"{label:<{width}}  {value}" for label, value in rows)
+
+    def save(self, path: Path) -> None:
+        path.write_text(json.dumps(self.to_dict(), indent=4))
+
+    def dump_profiles(self) -> None:
+        """Write the cProfile statistics of every profiled phase."""
+        if self.profile_dir is None:
+            return
+        self.profile_dir.mkdir(parents=True, exist_ok=True)
+        for name, profiler in self.profilers.items():
+            profiler.dump_stats(str(self.profile_dir / f"{name}.prof"))
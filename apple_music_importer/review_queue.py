@@ -0,0 +1,89 @@
+import json
+from pathlib import Path
+from typing import Optional
+from apple_music_importer.api.matcher import MIN_CONFIDENCE
+from apple_music_importer.utils import atomic_write_text
+
+# Key identifying a track of each source in the track list
+SOURCE_KEYS = {"local": "path", "spotify": "id"}
+
+
+def needs_review(result: Optional[dict]) -> bool:
+    """Check whether a search result is a miss or a weak match."""
+    return result is None or result.get("confidence", 1.0) < MIN_CONFIDENCE
+
+
+def get_track_key(source: str, track: dict):
+    """Return the key identifying a track within its source (path or Spotify ID)."""
+    return track.get(source, {}).get(SOURCE_KEYS[source])
+
+
+class ReviewQueue:
+    """
+    Tracks set aside for a later review session instead of prompting.
+
+    Entries are appended to a JSON lines file as the import runs, each
+    holding the source and key of the track, its tags and the weak
+    candidate if there was one (None if nothing was found).
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.file = None
+        self.count = 0
+
+    @staticmethod
+    def make_entry(source: str, track: dict, candidate: Optional[dict]) -> dict:
+        return {
+            "source": source,
+            "key": get_track_key(source, track),
+            "title": track.get("title", ""),
+            "artist": track.get("artist", ""),
+            "album": track.get("album", ""),
+            "candidate": candidate,
+        }
+
+    def add(self, source: str, track: dict, candidate: Optional[dict]) -> None:
+        if self.file is None:
+            self.file = self.path.open("a", encoding="utf-8")
+        entry = self.make_entry(source, track, candidate)
+        self.file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self.file.flush()
+        self.count += 1
+
+    def defer(self, source: str, track: dict, result: Optional[dict]):
+        """Queue the track if the result needs review and return the result to store."""
+        if not needs_review(result):
+            return result
+        self.add(source, track, result)
+        return None
+
+    def load(self) -> list:
+        """Return the queued entries, the latest one per track."""
+        entries = {}
+        if self.path.exists():
+            with self.path.open(encoding="utf-8") as file:
+                for line in file:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    entries.pop((entry["source"], entry["key"]), None)
+                    entries[(entry["source"], entry["key"])] = entry
+        return list(entries.values())
+
+    def replace(self, entries: list) -> None:
+        """Rewrite the queue with the given entries (deleting it if empty)."""
+        self.close()
+        if entries:
+            atomic_write_text(
+                self.path,
+                "".join(json.dumps(e, ensure_ascii=False) + "\n" for e in entries),
+            )
+        else:
+            self.path.unlink(missing_ok=True)
+
+    def close(self) -> None:
+        if self.file is not None:
+            self.file.close()
+            self.file = None
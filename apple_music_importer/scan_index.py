@@ -0,0 +1,68 @@
+import json
+import os
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Tuple
+from apple_music_importer.utils import atomic_write_text
+
+
+class ScanIndex:
+    """
+    Persistent index of scanned local files keyed by path.
+
+    Each entry records the size, modification time and extracted tags of a
+    file so that re-scans only read the tags of new or modified files, and
+    the hash of its audio data if it was deduplicated.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.entries: Dict[str, dict] = {}
+        if path.exists():
+            self.entries = json.loads(path.read_text())
+
+    @staticmethod
+    def stat(file: str) -> Tuple[int, int]:
+        """Return the size and modification time (ns) of a file."""
+        st = os.stat(file)
+        return st.st_size, st.st_mtime_ns
+
+    def is_current(self, file: str, size: int, mtime: int) -> bool:
+        """Check whether a file is unchanged since it was last indexed."""
+        entry = self.entries.get(file)
+        return entry is not None and entry["size"] == size and entry["mtime"] == mtime
+
+    def get_tags(self, file: str) -> Optional[dict]:
+        entry = self.entries.get(file)
+        return entry["tags"] if entry else None
+
+    def get_hash(self, file: str, size: int, mtime: int) -> Optional[str]:
+        """Return the cached audio hash of a file if it is unchanged since."""
+        if not self.is_current(file, size, mtime):
+            return None
+        return self.entries[file].get("hash")
+
+    def set_hash(self, file: str, content_hash: str) -> None:
+        self.entries[file]["hash"] = content_hash
+
+    def update(
+        self, file: str, size: int, mtime: int, tags: dict, content_hash: str = None
+    ) -> None:
+        self.entries[file] = {"size": size, "mtime": mtime, "tags": tags}
+        if content_hash is not None:
+            self.entries[file]["hash"] = content_hash
+
+    def prune(self, root: str, existing_files: Iterable[str]) -> list:
+        """Remove entries below root that no longer exist and return their paths."""
+        prefix = os.path.join(root, "")
+        existing_files = set(existing_files)
+        removed = [
+            file
+            for file in self.entries
+            if file.startswith(prefix) and file not in existing_files
+        ]
+        for file in removed:
+            del self.entries[file]
+        return removed
+
+    def save(self) -> None:
+        atomic_write_text(self.path, json.dumps(self.entries, ensure_ascii=False))
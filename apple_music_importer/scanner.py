@@ -0,0 +1,205 @@
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Iterator, Optional
+
+# Extensions of the files scanned by default
+DEFAULT_EXTENSIONS = frozenset({".mp3"})
+# Number of directories between progress messages while scanning
+PROGRESS_INTERVAL = 1000
+
+
+def _translate_pattern(pattern: str) -> str:
+    """Translate a gitignore-style glob into a regular expression body."""
+    parts = []
+    i = 0
+    while i < len(pattern):
+        if pattern.startswith("**/", i):
+            parts.append("(?:.*/)?")
+            i += 3
+        elif pattern.startswith("**", i):
+            parts.append(".*")
+            i += 2
+        elif pattern[i] == "*":
+            parts.append("[^/]*")
+            i += 1
+        elif pattern[i] == "?":
+            parts.append("[^/]")
+            i += 1
+        elif pattern[i] == "[" and "]" in pattern[i + 2 :]:
+            end = pattern.index("]", i + 2)
+            content = pattern[i + 1 : end]
+            if content.startswith("!"):
+                content = "^" + content[1:]
+            parts.append(f"[{content}]")
+            i = end + 1
+        else:
+            parts.append(re.escape(pattern[i]))
+            i += 1
+    return "".join(parts)
+
+
+class IgnoreRules:
+    """
+    Exclude patterns with gitignore semantics, matched against paths
+    relative to the scanned folder.
+
+    A pattern without a slash matches a name at any depth, one with a
+    slash is anchored at the folder, a trailing slash only matches
+    directories, "**" matches any number of directories and a leading "!"
+    includes again what an earlier pattern excluded. Files below an
+    excluded directory are never scanned.
+    """
+
+    def __init__(self, patterns: Iterable[str] = ()):
+        self.rules = []
+        for pattern in patterns:
+            self.add(pattern)
+
+    def add(self, pattern: str) -> None:
+        pattern = pattern.strip()
+        if not pattern or pattern.startswith("#"):
+            return
+        negate = pattern.startswith("!")
+        if negate:
+            pattern = pattern[1:]
+        directory_only = pattern.endswith("/")
+        pattern = pattern.rstrip("/")
+        if "/" in pattern:
+            regex = "^" + _translate_pattern(pattern.lstrip("/")) + "$"
+        else:
+            regex = "^(?:.*/)?" + _translate_pattern(pattern) + "$"
+        self.rules.append((re.compile(regex), negate, directory_only))
+
+    def __bool__(self):
+        return bool(self.rules)
+
+    def is_excluded(self, relative_path: str, is_dir: bool) -> bool:
+        """Check a relative path using "/" as separator; the last matching rule wins."""
+        excluded = False
+        for regex, negate, directory_only in self.rules:
+            if directory_only and not is_dir:
+                continue
+            if regex.match(relative_path):
+                excluded = not negate
+        return excluded
+
+
+class DirectoryScanner:
+    """
+    Walk a directory tree with several threads and stream matching files.
+
+    Directories are listed with os.scandir by a pool of threads, which
+    keeps many listings in flight on network filesystems. At most
+    `max_pending` listings (default four per thread) of the next
+    directories in walk order are in flight or waiting for the consumer,
+    so memory stays bounded however large the tree is. Files are
+    yielded in a stable order (depth first, sorted by name). Symbolic links to
+    directories are followed, except into a directory that contains the
+    link (a loop). The directories listed successfully are recorded in
+    `listed`, and the number of directories that could not be read in
+    `errors`.
+    """
+
+    def __init__(
+        self,
+        extensions: Iterable[str] = DEFAULT_EXTENSIONS,
+        ignore_rules: Optional[IgnoreRules] = None,
+        workers: int = 8,
+        max_pending: int = None,
+    ):
+        self.extensions = frozenset(
+            ext.lower() if ext.startswith(".") else f".{ext.lower()}"
+            for ext in extensions
+        )
+        self.ignore_rules = ignore_rules or IgnoreRules()
+        self.workers = workers
+        self.max_pending = max_pending or workers * 4
+        self.directories = 0
+        self.files = 0
+        self.listed = set()
+        self.errors = 0
+        self.lock = threading.Lock()
+
+    def _record_error(self, path: str, error: OSError) -> None:
+        print(f"Error reading {path}: {error}")
+        with self.lock:
+            self.errors += 1
+
+    def _scan(self, path: str, relative_path: str, ancestors: frozenset):
+        """
+        List one directory.
+
+        Returns the matching files and the (path, relative path, ancestors)
+        of the subdirectories, both sorted by name. `ancestors` holds the
+        (device, inode) of every directory above this one.
+        """
+        try:
+            st = os.stat(path)
+        except OSError as e:
+            self._record_error(path, e)
+            return [], []
+        if (st.st_dev, st.st_ino) in ancestors:
+            print(f"Skipping {path}: symlink loop")
+            return [], []
+        ancestors = ancestors | {(st.st_dev, st.st_ino)}
+        with self.lock:
+            self.directories += 1
+            if self.directories % PROGRESS_INTERVAL == 0:
+                print(f"Scanned {self.directories} directories...")
+
+        files = []
+        subdirectories = []
+        try:
+            with os.scandir(path) as entries:
+                entries = sorted(entries, key=lambda entry: entry.name)
+        except OSError as e:
+            self._record_error(path, e)
+            return [], []
+        with self.lock:
+            self.listed.add(path)
+        for entry in entries:
+            entry_relative_path = f"{relative_path}{entry.name}"
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                continue
+            if self.ignore_rules and self.ignore_rules.is_excluded(
+                entry_relative_path, is_dir
+            ):
+                continue
+            if is_dir:
+                subdirectories.append(
+                    (entry.path, f"{entry_relative_path}/", ancestors)
+                )
+            elif os.path.splitext(entry.name)[1].lower() in self.extensions:
+                files.append(entry.path)
+        return files, subdirectories
+
+    def walk(self, root: str) -> Iterator[str]:
+        """Yield the paths of matching files below root as they are found."""
+        executor = ThreadPoolExecutor(max_workers=self.workers)
+        # Directories still to walk, the next one last
+        stack = [(root, "", frozenset())]
+        listings = {}
+        try:
+            while stack:
+                # List the next directories in walk order ahead of time
+                for directory in reversed(stack[-self.max_pending :]):
+                    if len(listings) >= self.max_pending:
+                        break
+                    if directory[0] not in listings:
+                        listings[directory[0]] = executor.submit(
+                            self._scan, *directory
+                        )
+                directory = stack.pop()
+                listing = listings.pop(directory[0], None) or executor.submit(
+                    self._scan, *directory
+                )
+                files, subdirectories = listing.result()
+                self.files += len(files)
+                yield from files
+                stack.extend(reversed(subdirectories))
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
@@ -1,7 +1,25 @@
 import requests
+import random
+import threading
 import time
+import urllib.error
 import urllib.request
+import urllib3
 import json
+from email.utils import parsedate_to_datetime
+from apple_music_importer.metrics import Metrics, get_endpoint_name
+
+
+# Methods whose requests may be sent again after a read error or timeout
+IDEMPOTENT_METHODS = {"GET", "HEAD", "PUT", "DELETE"}
+
+
+def _is_connect_error(error) -> bool:
+    """Check whether a request failed before the server could receive it."""
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], "reason", None) if error.args else None
+    return isinstance(reason, urllib3.exceptions.NewConnectionError)
 
 
 class UnauthorizedRequestException(Exception):
@@ -10,56 +28,293 @@ class UnauthorizedRequestException(Exception):
     pass
 
 
+class RateLimitExceededException(Exception):
+    """Exception raised when a request is still rate limited after all retries."""
+
+    pass
+
+
+class RateLimiter:
+    """Token-bucket rate limiter shared by every thread issuing requests."""
+
+    def __init__(self, requests_per_second=1.0, burst=1):
+        self.rate = requests_per_second
+        self.capacity = max(burst, 1)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.blocked_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a request may be sent."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    wait = self.blocked_until - now
+                else:
+                    self.tokens = min(
+                        self.capacity,
+                        self.tokens + (now - self.updated_at) * self.rate,
+                    )
+                    self.updated_at = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """Hold back every caller for the given number of seconds."""
+        with self.lock:
+            now = time.monotonic()
+            self.blocked_until = max(self.blocked_until, now + seconds)
+            self.tokens = 0
+            self.updated_at = max(self.updated_at, self.blocked_until)
+
+
+class SharedRateLimiter(RateLimiter):
+    """
+    Token-bucket rate limiter shared by every process using the same file.
+
+    The bucket state is kept as JSON in the file and updated under an
+    exclusive lock (fcntl, so POSIX only), which lets several importer
+    processes, or hosts sharing a filesystem with working locks, spend one
+    request budget per credential. Pauses after throttling hold back every
+    process. Times are wall-clock times, so hosts need synchronized clocks.
+    """
+
+    def __init__(self, path, requests_per_second=1.0, burst=1):
+        super().__init__(requests_per_second, burst)
+        self.path = path
+
+    def _update(self, func):
+        """Apply func to the bucket state under the file lock and return its result."""
+        import fcntl
+
+        with open(self.path, "a+", encoding="utf-8") as file:
+            fcntl.flock(file, fcntl.LOCK_EX)
+            file.seek(0)
+            try:
+                state = json.loads(file.read())
+            except json.JSONDecodeError:
+                state = {
+                    "tokens": self.capacity,
+                    "updated_at": time.time(),
+                    "blocked_until": 0.0,
+                }
+            result = func(state)
+            file.seek(0)
+            file.truncate()
+            file.write(json.dumps(state))
+            file.flush()
+        return result
+
+    def _take(self, state):
+        now = time.time()
+        if now < state["blocked_until"]:
+            return state["blocked_until"] - now
+        state["tokens"] = min(
+            self.capacity,
+            state["tokens"] + max(now - state["updated_at"], 0.0) * self.rate,
+        )
+        state["updated_at"] = now
+        if state["tokens"] >= 1:
+            state["tokens"] -= 1
+            return 0.0
+        return (1 - state["tokens"]) / self.rate
+
+    def acquire(self):
+        """Block until a request may be sent by any of the sharing processes."""
+        while True:
+            wait = self._update(self._take)
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """Hold back every caller in every sharing process for the given time."""
+
+        def block(state):
+            now = time.time()
+            state["blocked_until"] = max(state["blocked_until"], now + seconds)
+            state["tokens"] = 0
+            state["updated_at"] = max(state["updated_at"], state["blocked_until"])
+
+        self._update(block)
+
+
+class ThrottlePolicy:
+    """
+    Adaptive throttling for rate-limited endpoints.
+
+    The request rate is halved when the server throttles us, at most once
+    per backoff window since every request in flight sees the same
+    throttling episode. It is raised additively for every `recover_interval`
+    seconds without a decrease (AIMD), never exceeding the rate the limiter
+    was configured with nor falling below `min_rate_ratio` of it.
+    """
+
+    def __init__(
+        self,
+        rate_limiter=None,
+        max_retries=10,
+        base_delay=5.0,
+        max_delay=300.0,
+        recover_interval=5.0,
+        min_rate_ratio=0.1,
+    ):
+        self.rate_limiter = rate_limiter
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.recover_interval = recover_interval
+        self.max_rate = rate_limiter.rate if rate_limiter else None
+        self.min_rate = self.max_rate * min_rate_ratio if rate_limiter else None
+        self.changed_at = time.monotonic()
+        self.hold_until = 0.0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _parse_retry_after(value):
+        """Parse a Retry-After header given in seconds or as an HTTP date."""
+        if not value:
+            return None
+        try:
+            return max(float(value), 0.0)
+        except ValueError:
+            pass
+        try:
+            return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+        except (TypeError, ValueError):
+            return None
+
+    def backoff(self, attempt, retry_after=None):
+        """Return the delay before the given retry attempt, with jitter."""
+        delay = self._parse_retry_after(retry_after)
+        if delay is None:
+            delay = min(self.max_delay, self.base_delay * 2**attempt)
+            return random.uniform(delay / 2, delay)
+        # Jitter in proportion, so that "Retry-After: 0" does not stall everyone
+        return delay + random.uniform(0, min(1.0, 0.05 + delay / 10))
+
+    def on_success(self):
+        """Speed back up additively once per recovery interval without a decrease."""
+        if self.rate_limiter is None:
+            return
+        with self.lock:
+            now = time.monotonic()
+            if now - self.changed_at < self.recover_interval:
+                return
+            self.changed_at = now
+            self.rate_limiter.rate = min(
+                self.max_rate, self.rate_limiter.rate + self.max_rate / 10
+            )
+
+    def on_throttle(self, attempt, retry_after=None):
+        """Slow down multiplicatively and return the delay before retrying."""
+        delay = self.backoff(attempt, retry_after)
+        if self.rate_limiter is None:
+            return delay
+        with self.lock:
+            now = time.monotonic()
+            # Several workers see the same throttling episode; only slow down once
+            if now >= self.hold_until:
+                self.rate_limiter.rate = max(self.min_rate, self.rate_limiter.rate / 2)
+                self.changed_at = now
+                self.hold_until = now + max(delay, self.recover_interval)
+        self.rate_limiter.pause(delay)
+        return delay
+
+
 class SessionHandler:
-    def __init__(self, request_headers):
+    def __init__(
+        self,
+        request_headers,
+        rate_limiter=None,
+        throttle_policy=None,
+        timeout=(10, 30),
+        metrics=None,
+    ):
         self.session = requests.Session()
         self.session.headers.update(request_headers)
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.throttle_policy = throttle_policy or ThrottlePolicy(self.rate_limiter)
+        self.timeout = timeout
+        self.metrics = metrics or Metrics()
+
+    def _request(self, method, url, **kwargs):
+        """Send a request, retrying with backoff while rate limited."""
+        endpoint = get_endpoint_name(method, url)
+        for attempt in range(self.throttle_policy.max_retries + 1):
+            if attempt:
+                self.metrics.record_retry()
+            started_at = time.monotonic()
+            self.rate_limiter.acquire()
+            self.metrics.record_wait(time.monotonic() - started_at)
+            started_at = time.monotonic()
+            try:
+                response = self.session.request(
+                    method, url, timeout=self.timeout, **kwargs
+                )
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if method not in IDEMPOTENT_METHODS and not _is_connect_error(e):
+                    # The server may have applied the request already
+                    raise
+                delay = self.throttle_policy.backoff(attempt)
+                print(f"Request failed ({e}). Retrying in {delay:.1f}s...")
+                self.metrics.record_connection_error(delay)
+                time.sleep(delay)
+                continue
+            self.metrics.record_request(
+                endpoint,
+                response.status_code,
+                len(response.content),
+                time.monotonic() - started_at,
+            )
+            if response.status_code in [401, 400]:
+                print(response.json())
+                raise UnauthorizedRequestException("Unauthorized request")
+            if response.status_code in [429, 403]:
+                delay = self.throttle_policy.on_throttle(
+                    attempt, response.headers.get("Retry-After")
+                )
+                print(f"Rate limit exceeded. Retrying in {delay:.1f}s...")
+                continue
+            response.raise_for_status()
+            self.throttle_policy.on_success()
+            return response.json() if response.content else None
+        raise RateLimitExceededException(
+            f"Giving up after {self.throttle_policy.max_retries} retries: {url}"
+        )
+
+    def get(self, url):
+        return self._request("GET", url)
+
+    def post(self, url, data=None):
+        return self._request("POST", url, json=data)
 
-    def get(self, url, request_delay=1):
-        time.sleep(request_delay)  # Ensure delay between requests
-        response = self.session.get(url)
-        if response.status_code in [401, 400]:
-            print(response.json())
-            raise UnauthorizedRequestException("Unauthorized request")
-        if response.status_code in [429, 403]:
-            print("Rate limit exceeded. Increasing delay and retrying...")
-            if request_delay > 10:
-                request_delay *= 2
-            else:
-                request_delay += 5
-            return self.get(url, request_delay)
-        response.raise_for_status()
-        return response.json()
-
-    def post(self, url, data=None, request_delay=1):
-        time.sleep(request_delay)
-        response = self.session.post(url, json=data)
-        if response.status_code in [401, 400]:
-            print(response.json())
-            raise UnauthorizedRequestException("Unauthorized request")
-        if response.status_code in [429, 403]:
-            print("Rate limit exceeded. Increasing delay and retrying...")
-            if request_delay > 10:
-                request_delay *= 2
-            else:
-                request_delay += 5
-            return self.post(url, data, request_delay)
-        response.raise_for_status()
-        return response.json()
+    def delete(self, url):
+        return self._request("DELETE", url)
 
     @staticmethod
-    def get_without_session(url, request_delay=1):
-        time.sleep(request_delay)  # Ensure delay between requests
-        with urllib.request.urlopen(url) as response:
-            if response.getcode() != 200:
-                if response.getcode() in [429, 403]:
-                    print("Rate limit exceeded. Increasing delay and retrying...")
-                    if request_delay > 10:
-                        request_delay *= 2
-                    else:
-                        request_delay += 5
-                    return SessionHandler.get_without_session(url, request_delay)
-                if response.getcode() in [401, 400]:
+    def get_without_session(url, throttle_policy=None, timeout=30):
+        throttle_policy = throttle_policy or ThrottlePolicy()
+        for attempt in range(throttle_policy.max_retries + 1):
+            try:
+                with urllib.request.urlopen(url, timeout=timeout) as response:
+                    return json.load(response)
+            except urllib.error.HTTPError as e:
+                if e.code in [401, 400]:
                     raise UnauthorizedRequestException("Unauthorized request")
-                raise Exception(f"Request failed with status code {response.getcode()}")
-            return json.load(response)
+                if e.code in [429, 403]:
+                    delay = throttle_policy.backoff(
+                        attempt, e.headers.get("Retry-After")
+                    )
+                    print(f"Rate limit exceeded. Retrying in {delay:.1f}s...")
+                    time.sleep(delay)
+                    continue
+                raise Exception(f"Request failed with status code {e.code}")
+        raise RateLimitExceededException(
+            f"Giving up after {throttle_policy.max_retries} retries: {url}"
+        )
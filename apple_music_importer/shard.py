@@ -0,0 +1,96 @@
+import json
+import os
+import shutil
+import socket
+import time
+from pathlib import Path
+from typing import Optional
+from apple_music_importer.utils import atomic_write_text
+
+
+def get_default_worker_id() -> str:
+    """Return a worker ID unique across the hosts sharing a track list."""
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class LeaseDirectory:
+    """
+    Leases on ranges of a track list, claimed by the workers of a sharded run.
+
+    Every range has a lease file in the directory holding the ID of the
+    worker that claimed it, when the lease expires and whether the range is
+    done. A range is claimed by creating its file exclusively; a worker
+    keeps its lease by renewing it, so the ranges of a worker that crashed
+    or was stopped can be claimed by another worker once its lease expires.
+    """
+
+    def __init__(self, path: Path, worker_id: str, ttl: float = 300.0):
+        self.path = path
+        self.worker_id = worker_id
+        self.ttl = ttl
+        self.renewed_at = {}
+
+    def _lease_path(self, chunk: int) -> Path:
+        return self.path / f"{chunk}.lease"
+
+    def _read(self, chunk: int) -> Optional[dict]:
+        try:
+            return json.loads(self._lease_path(chunk).read_text())
+        except FileNotFoundError:
+            return None
+        except json.JSONDecodeError:
+            # Being written by its creator; treat it as freshly claimed
+            return {"worker": None, "expires": time.time() + self.ttl, "done": False}
+
+    def _write(self, chunk: int, done=False) -> None:
+        lease = {
+            "worker": self.worker_id,
+            "expires": time.time() + self.ttl,
+            "done": done,
+        }
+        atomic_write_text(self._lease_path(chunk), json.dumps(lease))
+        self.renewed_at[chunk] = time.monotonic()
+
+    def claim(self, chunk: int) -> bool:
+        """Claim a range unless it is done or leased by a live worker."""
+        self.path.mkdir(parents=True, exist_ok=True)
+        try:
+            fd = os.open(self._lease_path(chunk), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            lease = self._read(chunk)
+            if lease is not None and (lease["done"] or lease["expires"] > time.time()):
+                return False
+            # Take over an expired lease; when several workers race for it,
+            # the last one to write wins and the others back off
+            self._write(chunk)
+            time.sleep(0.1)
+            lease = self._read(chunk)
+            return lease is not None and lease["worker"] == self.worker_id
+        os.close(fd)
+        self._write(chunk)
+        return True
+
+    def renew(self, chunk: int) -> None:
+        """Extend a claimed lease once half of its time has passed."""
+        if time.monotonic() - self.renewed_at.get(chunk, 0.0) >= self.ttl / 2:
+            self._write(chunk)
+
+    def finish(self, chunk: int) -> None:
+        """Mark a claimed range as done so no worker claims it again."""
+        self._write(chunk, done=True)
+        self.renewed_at.pop(chunk, None)
+
+    def active_workers(self) -> set:
+        """Return the IDs of workers holding unexpired leases on unfinished ranges."""
+        workers = set()
+        if self.path.exists():
+            now = time.time()
+            for lease_path in self.path.glob("*.lease"):
+                lease = self._read(int(lease_path.stem))
+                if lease is not None and not lease["done"] and lease["expires"] > now:
+                    workers.add(lease["worker"])
+        return workers
+
+    def clear(self) -> None:
+        """Remove every lease, e.g. after the results of a run were merged."""
+        shutil.rmtree(self.path, ignore_errors=True)
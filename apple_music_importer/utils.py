@@ -1,8 +1,18 @@
+import glob
+import gzip
 import json
+import os
+import re
+import tempfile
+from collections import Counter, defaultdict
+from functools import lru_cache
 from pathlib import Path
 from typing import List, Dict, Any
 import unicodedata
 
+# First bytes of a gzip-compressed file
+GZIP_MAGIC = b"\x1f\x8b"
+
 
 def normalize(value):
     """Convert full-width characters to half-width (except for kana) and handle lists."""
@@ -11,9 +21,133 @@ def normalize(value):
     return unicodedata.normalize("NFKC", value.replace("’", "'").strip())
 
 
+# Featured artist credits, which are dropped when comparing text
+_SUPPLEMENT = re.compile(
+    r"\s*(\((?:feat|ft|with|from)\b[^)]*\)|\[(?:feat|ft|with|from)\b[^\]]*\]|\s(?:feat|ft)\.?\s.*$)"
+)
+_NON_WORD = re.compile(r"[^\w\s]")
+
+
+@lru_cache(maxsize=65536)
+def normalize_text(value: str) -> str:
+    """Lower-case a title/artist/album and strip featured artists and symbols."""
+    value = _SUPPLEMENT.sub("", normalize(value or "").lower())
+    return " ".join(_NON_WORD.sub(" ", value).split())
+
+
+def _get_default_file_mode() -> int:
+    """Return the mode of newly created files under the current umask."""
+    # Setting the umask is the only portable way to read it; this runs once
+    # at import, before any thread could create a file in between
+    umask = os.umask(0o022)
+    os.umask(umask)
+    return 0o666 & ~umask
+
+
+_DEFAULT_FILE_MODE = _get_default_file_mode()
+
+
+def atomic_write_bytes(path: Path, data: bytes) -> None:
+    """
+    Write a file so that readers never observe a partially written state.
+
+    The file keeps the mode of the file it replaces, or gets the default
+    mode for new files, instead of the private mode of temporary files.
+    """
+    try:
+        mode = os.stat(path).st_mode & 0o7777
+    except FileNotFoundError:
+        mode = _DEFAULT_FILE_MODE
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+    try:
+        with os.fdopen(fd, "wb") as file:
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def atomic_write_text(path: Path, text: str) -> None:
+    """Write a text file atomically (see atomic_write_bytes)."""
+    atomic_write_bytes(path, text.encode("utf-8"))
+
+
+def get_sidecar_path(track_list_path: Path, suffix: str) -> Path:
+    """Return the path of a file stored alongside a track list."""
+    return track_list_path.with_name(f"{track_list_path.name}.{suffix}")
+
+
+def get_journal_path(track_list_path: Path) -> Path:
+    """Return the path of the update journal belonging to a track list."""
+    return get_sidecar_path(track_list_path, "journal")
+
+
+def get_worker_journal_paths(track_list_path: Path) -> List[Path]:
+    """Return the journals written by the workers of a sharded run, by worker ID."""
+    return sorted(
+        track_list_path.parent.glob(f"{glob.escape(track_list_path.name)}.journal.*")
+    )
+
+
+def _get_track_identity(track: Dict[str, Any]):
+    for service in ("local", "spotify"):
+        if isinstance(track.get(service), dict):
+            service_id = _get_service_id(service, track[service])
+            if service_id is not None:
+                return service_id
+    return None
+
+
+def _replay_journal(
+    track_list: List[Dict[str, Any]], journal_path: Path, check_identity=False
+) -> int:
+    """
+    Apply journaled track updates to a track list and return their count.
+
+    With check_identity, an update is only applied to the track at its
+    index if both are the same local file or Spotify track; otherwise the
+    track is looked up by its identity, and the update is dropped if the
+    track is no longer in the list.
+    """
+    count = 0
+    identities = None
+    with journal_path.open(encoding="utf-8") as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # A line may be incomplete if the process crashed mid-write
+                continue
+            index = record["index"]
+            if check_identity:
+                identity = _get_track_identity(record["track"])
+                if index >= len(track_list) or identity != _get_track_identity(
+                    track_list[index]
+                ):
+                    if identities is None:
+                        identities = {
+                            _get_track_identity(track): i
+                            for i, track in enumerate(track_list)
+                        }
+                    index = identities.get(identity)
+                    if identity is None or index is None:
+                        continue
+            if index < len(track_list):
+                track_list[index] = record["track"]
+            else:
+                track_list.append(record["track"])
+            count += 1
+    return count
+
+
 def load_track_list(track_list_path: Path) -> List[Dict[str, Any]]:
     """
-    Load track information from a JSON file.
+    Load track information from a JSON file (optionally gzip-compressed)
+    and its update journal.
 
     Args:
         track_list_path: Path to existing track JSON file
@@ -21,85 +155,306 @@ def load_track_list(track_list_path: Path) -> List[Dict[str, Any]]:
     Returns:
         List of track information dictionaries
     """
+    track_list = []
     if track_list_path.exists():
         print(f"Loading tracks from {track_list_path}...")
-        return json.loads(track_list_path.read_text())
+        data = track_list_path.read_bytes()
+        if data[:2] == GZIP_MAGIC:
+            data = gzip.decompress(data)
+        track_list = json.loads(data)
+
+    journal_path = get_journal_path(track_list_path)
+    if journal_path.exists():
+        count = _replay_journal(track_list, journal_path)
+        print(f"Recovered {count} track updates from {journal_path}")
 
-    return []
+    # Workers of a sharded run write their own journals and never the list;
+    # they are folded into it by the next save
+    for worker_journal_path in get_worker_journal_paths(track_list_path):
+        count = _replay_journal(track_list, worker_journal_path, True)
+        print(f"Merged {count} track updates from {worker_journal_path}")
+
+    return track_list
 
 
 def save_track_list(track_list: List[Dict[str, Any]], track_list_path: Path) -> None:
     """
-    Save track information to a JSON file.
+    Atomically save track information to a JSON file and clear its journals.
+
+    Track lists whose name ends in ".gz" are written as gzip-compressed
+    JSON without indentation, others as indented JSON. The journals of
+    sharded workers are removed as well, since loading the track list
+    merged them; commands that save a track list must therefore not run
+    while workers are active (see ensure_no_active_workers).
 
     Args:
         track_dict: Track information to save
         track_list_path: Path to file for saving
     """
-    track_list_path.write_text(json.dumps(track_list, indent=2, ensure_ascii=False))
+    if track_list_path.suffix == ".gz":
+        data = json.dumps(track_list, ensure_ascii=False, separators=(",", ":"))
+        atomic_write_bytes(
+            track_list_path, gzip.compress(data.encode("utf-8"), compresslevel=6)
+        )
+    else:
+        atomic_write_text(
+            track_list_path, json.dumps(track_list, indent=2, ensure_ascii=False)
+        )
+    get_journal_path(track_list_path).unlink(missing_ok=True)
+    for worker_journal_path in get_worker_journal_paths(track_list_path):
+        worker_journal_path.unlink(missing_ok=True)
     print(f"Progress saved to {track_list_path}")
 
 
-def merge_tracks(service, new_tracks, track_list):
-    def safe_get(d, keys, default=None):
-        for key in keys:
-            if not isinstance(d, dict):
-                return default
-            d = d.get(key)
-        return d if d is not None else default
-
-    isrc_dict = {
-        safe_get(track, ["apple_music", "response", "attributes", "isrc"]): track
-        for track in track_list
-        if safe_get(track, ["apple_music", "response", "attributes", "isrc"])
-    }
+class TrackJournal:
+    """
+    Append-only journal recording track updates as they happen.
 
-    title_artist_dict = {
-        f"{track.get('title', '')}|{track.get('artist', '')}": track
-        for track in track_list
-        if track.get("title") and track.get("artist")
-    }
-    title_dict = {
-        track.get("title", ""): track for track in track_list if track.get("title")
+    Each update costs one appended line; the journal is compacted into the
+    track list once it holds as many records as the list has tracks, which
+    keeps the amortized cost per update constant.
+
+    A worker of a sharded run passes its worker ID to write a journal of its
+    own (`<track list>.journal.<worker ID>`) instead. Such a journal is never
+    compacted, since other workers share the track list; it is merged when
+    the track list is loaded, and removed by `work --merge`.
+    """
+
+    def __init__(
+        self,
+        track_list: List[Dict[str, Any]],
+        track_list_path: Path,
+        worker_id: str = None,
+    ):
+        self.track_list = track_list
+        self.track_list_path = track_list_path
+        self.worker_id = worker_id
+        self.journal_path = get_journal_path(track_list_path)
+        if worker_id is not None:
+            self.journal_path = get_sidecar_path(
+                track_list_path, f"journal.{worker_id}"
+            )
+        self.records = 0
+        self.file = None
+
+    def _open(self):
+        if self.journal_path.exists() and self.journal_path.stat().st_size > 0:
+            # Terminate a line left incomplete by a crash before appending
+            with self.journal_path.open("rb+") as file:
+                file.seek(-1, os.SEEK_END)
+                if file.read(1) != b"\n":
+                    file.write(b"\n")
+        return self.journal_path.open("a", encoding="utf-8")
+
+    def record(self, index: int) -> None:
+        """Persist the current state of the track at the given index."""
+        if self.file is None:
+            self.file = self._open()
+        line = json.dumps(
+            {"index": index, "track": self.track_list[index]}, ensure_ascii=False
+        )
+        self.file.write(line + "\n")
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.records += 1
+        if self.worker_id is None and self.records >= max(1000, len(self.track_list)):
+            self.compact()
+
+    def compact(self) -> None:
+        """Rewrite the track list with all recorded updates and empty the journal."""
+        self.close()
+        if self.worker_id is not None:
+            return
+        save_track_list(self.track_list, self.track_list_path)
+        self.records = 0
+
+    def close(self) -> None:
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+# Number of merged tracks between progress messages
+MERGE_PROGRESS_INTERVAL = 10_000
+# Service data keys identifying a track within its service
+_SERVICE_ID_KEYS = ("id", "path")
+
+
+def _get_service_data(service, track):
+    if service in track and isinstance(track[service], dict):
+        return track[service].copy()
+    return {
+        k: v for k, v in track.items() if k not in ("title", "artist", "album", service)
     }
 
-    def get_service_data(track):
-        if service in track and isinstance(track[service], dict):
-            return track[service].copy()
-        return {
-            k: v
-            for k, v in track.items()
-            if k not in ("title", "artist", "album", service)
-        }
-
-    for i, track in enumerate(new_tracks):
-        print(f"Processing track {i+1}/{len(new_tracks)}...")
-        isrc = track.get("isrc", "")
-        title = track.get("title", "")
-        artist = track.get("artist", "")
-
-        if isrc and isrc in isrc_dict:
-            service_data = get_service_data(track)
-            service_data["match_type"] = "isrc"
-            isrc_dict[isrc][service] = service_data
-        elif title and artist and f"{title}|{artist}" in title_artist_dict:
-            service_data = get_service_data(track)
-            service_data["match_type"] = "title_artist"
-            title_artist_dict[f"{title}|{artist}"][service] = service_data
-        elif title and title in title_dict:
-            service_data = get_service_data(track)
-            service_data["match_type"] = "title"
-            title_dict[title][service] = service_data
-        else:
-            print(f"No match found for {title} by {artist}")
-            service_data = get_service_data(track)
-            service_data["match_type"] = "new"
-            track_to_be_added = {
-                "title": title,
-                "artist": artist,
-                "album": track.get("album", ""),
-                service: service_data,
-            }
-            track_list.append(track_to_be_added)
 
+def _get_isrcs(track):
+    """Return the upper-case ISRCs known for a track from any source."""
+    isrcs = set()
+    for value in track.values():
+        if not isinstance(value, dict):
+            continue
+        attributes = value.get("attributes") or value.get("response", {}).get(
+            "attributes", {}
+        )
+        for isrc in (value.get("isrc"), attributes.get("isrc")):
+            if isrc:
+                isrcs.add(isrc.upper())
+    return isrcs
+
+
+def _get_service_id(service, service_data):
+    for key in _SERVICE_ID_KEYS:
+        if service_data.get(key):
+            return (service, key, service_data[key])
+    return None
+
+
+class TrackMerger:
+    """
+    Merge tracks from a service into a track list using normalized indexes.
+
+    Existing tracks are indexed by service ID (Spotify ID or local path),
+    ISRC, normalized title and artist, and normalized title. Every index
+    holds all matching tracks and is kept up to date as tracks are merged
+    or appended, so each incoming track is matched in constant time.
+    Among several matches, the first indexed track without data from the
+    service yet is used; if they all have some, the track is added as new
+    rather than overwriting another track's data. A cursor per service and
+    index entry skips the tracks that already have data from the service,
+    so many tracks with a common title are still merged in linear time.
+    """
+
+    def __init__(self, track_list: List[Dict[str, Any]]):
+        self.track_list = track_list
+        self.by_service_id = {}
+        self.by_isrc = defaultdict(list)
+        self.by_title_artist = defaultdict(list)
+        self.by_title = defaultdict(list)
+        # Position of the first track without data from the service per index entry
+        self.cursors = defaultdict(dict)
+        for index in range(len(track_list)):
+            self.add(index)
+
+    def _index(self, index, title, artist, isrcs=()):
+        if title and artist:
+            self.by_title_artist[(title, artist)].append(index)
+        if title:
+            self.by_title[title].append(index)
+        for isrc in isrcs:
+            if index not in self.by_isrc[isrc]:
+                self.by_isrc[isrc].append(index)
+
+    def add(self, index: int) -> None:
+        """Index the track at the given position."""
+        track = self.track_list[index]
+        for service, data in track.items():
+            if isinstance(data, dict):
+                service_id = _get_service_id(service, data)
+                if service_id is not None:
+                    self.by_service_id.setdefault(service_id, index)
+        self._index(
+            index,
+            normalize_text(track.get("title")),
+            normalize_text(track.get("artist")),
+            _get_isrcs(track),
+        )
+
+    def remove(self, index: int) -> None:
+        """Drop the track from the text and ISRC indexes, e.g. before its tags change."""
+        track = self.track_list[index]
+        title = normalize_text(track.get("title"))
+        artist = normalize_text(track.get("artist"))
+        entries = [
+            (("isrc", isrc), self.by_isrc.get(isrc)) for isrc in _get_isrcs(track)
+        ]
+        entries += [
+            (("title_artist", (title, artist)), self.by_title_artist.get((title, artist))),
+            (("title", title), self.by_title.get(title)),
+        ]
+        for key, entry in entries:
+            if entry and index in entry:
+                position = entry.index(index)
+                del entry[position]
+                for cursors in self.cursors.values():
+                    if cursors.get(key, 0) > position:
+                        cursors[key] -= 1
+
+    def _pick(self, service, key, candidates):
+        if not candidates:
+            return None
+        cursors = self.cursors[service]
+        position = cursors.get(key, 0)
+        while (
+            position < len(candidates)
+            and service in self.track_list[candidates[position]]
+        ):
+            position += 1
+        cursors[key] = position
+        return candidates[position] if position < len(candidates) else None
+
+    def find(self, service, service_id, isrc, title, artist):
+        """Return (index, match_type) of the existing track to merge into, or (None, None)."""
+        if service_id in self.by_service_id:
+            return self.by_service_id[service_id], "id"
+        lookups = [
+            ("isrc", isrc, self.by_isrc.get(isrc) if isrc else None),
+            ("title_artist", (title, artist), self.by_title_artist.get((title, artist))),
+            ("title", title, self.by_title.get(title)),
+        ]
+        for match_type, key, candidates in lookups:
+            index = self._pick(service, (match_type, key), candidates)
+            if index is not None:
+                return index, match_type
+        return None, None
+
+    def merge(self, service, new_tracks) -> list:
+        """Merge new_tracks into the track list and return the indexes touched."""
+        touched = []
+        counts = Counter()
+        for i, track in enumerate(new_tracks, 1):
+            service_data = _get_service_data(service, track)
+            service_id = _get_service_id(service, service_data)
+            isrc = (track.get("isrc") or "").upper()
+            title = normalize_text(track.get("title"))
+            artist = normalize_text(track.get("artist"))
+
+            index, match_type = self.find(service, service_id, isrc, title, artist)
+            counts[match_type or "new"] += 1
+            if index is None:
+                match_type = "new"
+                index = len(self.track_list)
+                self.track_list.append(
+                    {
+                        "title": track.get("title", ""),
+                        "artist": track.get("artist", ""),
+                        "album": track.get("album", ""),
+                    }
+                )
+                self._index(index, title, artist)
+            elif match_type == "id":
+                # Seen before; keep how it was matched originally
+                match_type = self.track_list[index][service].get("match_type", "id")
+
+            service_data["match_type"] = match_type
+            self.track_list[index][service] = service_data
+            if service_id is not None:
+                self.by_service_id.setdefault(service_id, index)
+            if isrc:
+                self._index(index, None, None, [isrc])
+            touched.append(index)
+            if i % MERGE_PROGRESS_INTERVAL == 0:
+                print(f"Merged {i}/{len(new_tracks)} tracks...")
+
+        if new_tracks:
+            print(
+                f"Merged {len(new_tracks)} tracks: "
+                + ", ".join(f"{t}: {n}" for t, n in sorted(counts.items()))
+            )
+        return touched
+
+
+def merge_tracks(service, new_tracks, track_list):
+    """Merge tracks from a service into track_list in place and return it."""
+    TrackMerger(track_list).merge(service, new_tracks)
     return track_list
@@ -0,0 +1,230 @@
+"""A local stand-in for the Apple Music API endpoints used by the importer."""
+
+import json
+import random
+import re
+import threading
+import time
+import urllib.parse
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from synthetic import SyntheticCatalog, make_album, make_artist, make_song
+
+_SEARCH = re.compile(r"^/v1/catalog/[^/]+/search$")
+_SONGS = re.compile(r"^/v1/catalog/[^/]+/songs$")
+_LIBRARY = re.compile(r"^/v1/me/library$")
+_LIBRARY_SONGS = re.compile(r"^/v1/me/library/songs$")
+_LIBRARY_SONG = re.compile(r"^/v1/me/library/songs/([^/]+)$")
+_PLAYLISTS = re.compile(r"^/v1/me/library/playlists$")
+_PLAYLIST_TRACKS = re.compile(r"^/v1/me/library/playlists/([^/]+)/tracks$")
+
+
+def _select_fields(resource, fields):
+    """Keep only the attributes listed in a fields[<type>] parameter."""
+    if fields is None:
+        return resource
+    names = set(fields.split(","))
+    attributes = {
+        key: value for key, value in resource["attributes"].items() if key in names
+    }
+    return {**resource, "attributes": attributes}
+
+
+def _reference(resource):
+    return {"id": resource["id"], "type": resource["type"]}
+
+
+class MockAppleMusicServer:
+    """
+    Threaded HTTP server imitating the Apple Music catalog and library API.
+
+    Every request is delayed by `latency` seconds, and a `throttle_ratio`
+    share of requests is answered with 429 and a Retry-After header.
+    Searches honor `types`, `fields[...]`, `include[songs]` and
+    `relate[songs]`, so lean and full search profiles get responses of
+    different sizes.
+    """
+
+    def __init__(
+        self,
+        catalog_size=10_000,
+        library_size=0,
+        latency=0.0,
+        throttle_ratio=0.0,
+        retry_after=0,
+        seed=0,
+    ):
+        self.catalog = SyntheticCatalog(catalog_size)
+        self.latency = latency
+        self.throttle_ratio = throttle_ratio
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = Counter()
+        self.throttled = 0
+        self.latencies = []
+        self.bytes_sent = 0
+        self.library = [
+            {
+                "id": f"i.{n}",
+                "type": "library-songs",
+                "attributes": {
+                    "name": f"Song {n}",
+                    "artistName": make_song(n)["attributes"]["artistName"],
+                    "dateAdded": f"2020-01-01T00:00:{n:09d}Z",
+                    # Every tenth library song is an upload without catalog match
+                    "playParams": (
+                        {"id": f"i.{n}", "kind": "song"}
+                        if n % 10 == 0
+                        else {"id": f"i.{n}", "kind": "song", "catalogId": make_song(n)["id"]}
+                    ),
+                },
+            }
+            for n in range(library_size)
+        ][::-1]
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._make_handler())
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address
+        return f"http://{host}:{port}"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def reset_stats(self):
+        with self.lock:
+            self.requests.clear()
+            self.throttled = 0
+            self.latencies = []
+            self.bytes_sent = 0
+
+    def _should_throttle(self):
+        with self.lock:
+            return self.random.random() < self.throttle_ratio
+
+    def _route(self, method, path, query, body):
+        """Return (endpoint name, status, response body) for a request."""
+        if method == "GET" and _SEARCH.match(path):
+            return "search", 200, self._search(query)
+        if method == "GET" and _SONGS.match(path):
+            isrcs = query.get("filter[isrc]", "").split(",")
+            songs = [self.catalog.get_by_isrc(isrc) for isrc in isrcs]
+            return "songs", 200, {"data": [song for song in songs if song]}
+        if method == "GET" and _LIBRARY_SONGS.match(path):
+            offset, limit = int(query.get("offset", 0)), int(query.get("limit", 100))
+            page = self.library[offset : offset + limit]
+            has_next = offset + limit < len(self.library)
+            return "library-songs", 200, {
+                "data": page,
+                "meta": {"total": len(self.library)},
+                "next": f"{path}?offset={offset + limit}" if has_next else None,
+            }
+        if method == "POST" and _LIBRARY.match(path):
+            return "library-add", 202, None
+        if method == "POST" and _PLAYLISTS.match(path):
+            return "playlist-create", 201, {"data": [{"id": "p.benchmark"}]}
+        if method == "POST" and _PLAYLIST_TRACKS.match(path):
+            return "playlist-tracks", 204, None
+        if method == "DELETE" and _LIBRARY_SONG.match(path):
+            return "library-delete", 204, None
+        return "unknown", 404, {"errors": [{"status": "404"}]}
+
+    def _search(self, query):
+        """Answer a catalog search with the requested types and fields."""
+        types = query.get("types", "songs").split(",")
+        numbers = self.catalog.search_numbers(
+            query.get("term", ""), int(query.get("limit", 3))
+        )
+        related = {
+            "albums": "albums" in query.get("relate[songs]", "").split(","),
+            "artists": "artists" in query.get("include[songs]", "").split(","),
+        }
+        resources = {}
+        for n in numbers:
+            albums = [make_album(n)]
+            artists = [make_artist(n)]
+            if "songs" in types:
+                song = _select_fields(make_song(n), query.get("fields[songs]"))
+                relationships = {
+                    name: {"data": [_reference(r) for r in rs]}
+                    for name, rs in (("albums", albums), ("artists", artists))
+                    if related[name]
+                }
+                if relationships:
+                    song["relationships"] = relationships
+                resources.setdefault("songs", {})[song["id"]] = song
+            for name, rs in (("albums", albums), ("artists", artists)):
+                if name in types or related[name]:
+                    for r in rs:
+                        resources.setdefault(name, {})[r["id"]] = _select_fields(
+                            r, query.get(f"fields[{name}]")
+                        )
+        results = {
+            name: {"data": [_reference(r) for r in rs.values()]}
+            for name, rs in resources.items()
+            if name in types
+        }
+        return {"results": results, "resources": resources}
+
+    def _make_handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Send the headers and body of a response in one write; unbuffered
+            # writes stall keep-alive connections on Nagle and delayed ACKs
+            wbufsize = -1
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def _handle(self, method):
+                started_at = time.monotonic()
+                parsed = urllib.parse.urlsplit(self.path)
+                query = dict(urllib.parse.parse_qsl(parsed.query))
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                time.sleep(mock.latency)
+
+                if mock._should_throttle():
+                    endpoint, status, payload = "throttled", 429, None
+                    with mock.lock:
+                        mock.throttled += 1
+                else:
+                    endpoint, status, payload = mock._route(
+                        method, parsed.path, query, body
+                    )
+
+                data = json.dumps(payload).encode() if payload is not None else b""
+                self.send_response(status)
+                if status == 429:
+                    self.send_header("Retry-After", str(mock.retry_after))
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+                self.wfile.flush()
+                with mock.lock:
+                    mock.requests[endpoint] += 1
+                    mock.latencies.append(time.monotonic() - started_at)
+                    mock.bytes_sent += len(data)
+
+            def do_GET(self):
+                self._handle("GET")
+
+            def do_POST(self):
+                self._handle("POST")
+
+            def do_DELETE(self):
+                self._handle("DELETE")
+
+        return Handler
@@ -0,0 +1,178 @@
+"""
+Run end-to-end benchmarks of the importer against a local mock server.
+
+Example:
+    python benchmarks/run.py --scenario local --tracks 2000 --latency 0.05 \
+        --concurrency 8 --requests-per-second 100
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from typer.testing import CliRunner  # noqa: E402
+from apple_music_importer.api.spotify import SpotifyAPI  # noqa: E402
+from apple_music_importer.cli import app  # noqa: E402
+from apple_music_importer.metrics import Metrics  # noqa: E402
+from mock_server import MockAppleMusicServer  # noqa: E402
+from synthetic import StubSpotifyClient, generate_mp3_tree  # noqa: E402
+
+SCENARIOS = ("local", "spotify", "sync")
+
+
+def _percentile(values, percent):
+    if not values:
+        return 0.0
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[percent - 1]
+
+
+def _global_options(args, server, workdir):
+    options = [
+        "--request-headers",
+        str(workdir / "headers.json"),
+        "--track-list",
+        str(workdir / "tracks.list"),
+        "--api-base-url",
+        server.base_url,
+        "--concurrency",
+        str(args.concurrency),
+        "--requests-per-second",
+        str(args.requests_per_second),
+        "--search-profile",
+        args.search_profile,
+        "--cache-path",
+        str(workdir / "cache.db"),
+    ]
+    if not args.cache:
+        options.append("--no-cache")
+    return options
+
+
+def _invoke(arguments):
+    result = CliRunner().invoke(app, arguments, catch_exceptions=False)
+    if result.exit_code != 0:
+        raise RuntimeError(f"Command failed ({result.exit_code}):\n{result.output}")
+    return result
+
+
+def _local_command(args, workdir):
+    return [
+        "local",
+        str(workdir / "music"),
+        "--tag-reader",
+        args.tag_reader,
+        "--tag-workers",
+        str(args.tag_workers),
+    ]
+
+
+def run_scenario(args, workdir: Path) -> dict:
+    """Run one scenario in workdir and return its measurements."""
+    (workdir / "headers.json").write_text(json.dumps({"authorization": "Bearer x"}))
+    server = MockAppleMusicServer(
+        catalog_size=args.tracks,
+        library_size=args.library_size,
+        latency=args.latency,
+        throttle_ratio=args.throttle_ratio,
+        retry_after=0,
+        seed=args.seed,
+    )
+    with server:
+        options = _global_options(args, server, workdir)
+        if args.scenario in ("local", "sync"):
+            generate_mp3_tree(
+                str(workdir / "music"), args.tracks, args.miss_ratio, args.seed
+            )
+
+        if args.scenario == "local":
+            command = _local_command(args, workdir)
+        elif args.scenario == "spotify":
+            command = ["spotify", "benchmark", "--fetch-workers", "4"]
+        else:
+            # Sync needs a searched track list, which is not part of the measurement
+            _invoke(options + _local_command(args, workdir))
+            server.reset_stats()
+            command = ["sync", "--sync-local", "--add-to-library", "--create-playlist"]
+
+        client = StubSpotifyClient(
+            args.tracks, args.isrc_ratio, args.miss_ratio, args.seed
+        )
+        # Latency as seen by the importer, including the connection overhead
+        latencies = []
+        record_request = Metrics.record_request
+
+        def record_and_collect(metrics, endpoint, status, size, elapsed):
+            latencies.append(elapsed)
+            record_request(metrics, endpoint, status, size, elapsed)
+
+        with mock.patch(
+            "apple_music_importer.commands.spotify.SpotifyAPI",
+            lambda: SpotifyAPI(client),
+        ), mock.patch.object(Metrics, "record_request", record_and_collect):
+            started_at = time.perf_counter()
+            _invoke(options + command)
+            elapsed = time.perf_counter() - started_at
+
+        requests = sum(server.requests.values())
+        latencies.sort()
+        server_latencies = sorted(server.latencies)
+        return {
+            "scenario": args.scenario,
+            "tracks": args.tracks,
+            "seconds": round(elapsed, 3),
+            "tracks_per_second": round(args.tracks / elapsed, 1),
+            "requests": requests,
+            "requests_per_track": round(requests / args.tracks, 3),
+            "requests_by_endpoint": dict(server.requests),
+            "throttled": server.throttled,
+            "spotify_requests": client.requests if args.scenario == "spotify" else 0,
+            "bytes_per_request": round(server.bytes_sent / max(requests, 1)),
+            "latency_p50_ms": round(_percentile(latencies, 50) * 1000, 2),
+            "latency_p99_ms": round(_percentile(latencies, 99) * 1000, 2),
+            "server_latency_p50_ms": round(
+                _percentile(server_latencies, 50) * 1000, 2
+            ),
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--scenario", choices=SCENARIOS, default="local")
+    parser.add_argument("--tracks", type=int, default=1000)
+    parser.add_argument("--library-size", type=int, default=0)
+    parser.add_argument("--miss-ratio", type=float, default=0.1)
+    parser.add_argument("--isrc-ratio", type=float, default=0.8)
+    parser.add_argument("--latency", type=float, default=0.02, help="Seconds per request")
+    parser.add_argument("--throttle-ratio", type=float, default=0.0)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--requests-per-second", type=float, default=1000.0)
+    parser.add_argument("--search-profile", choices=("lean", "full"), default="lean")
+    parser.add_argument("--tag-reader", choices=("eyed3", "fast"), default="fast")
+    parser.add_argument("--tag-workers", type=int, default=1)
+    parser.add_argument("--no-cache", dest="cache", action="store_false")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=Path, help="Write the report as JSON")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        report = run_scenario(args, Path(workdir))
+
+    for key, value in report.items():
+        print(f"{key}: {value}")
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+"""Synthetic catalogs, MP3 trees and a stub Spotify client for benchmarks."""
+
+import os
+import random
+import re
+
+# Number of distinct artists and songs per album in the synthetic catalog
+ARTIST_COUNT = 500
+ALBUM_SIZE = 10
+
+_SONG_NUMBER = re.compile(r"\bsong (\d+)\b")
+
+
+def make_song(i: int) -> dict:
+    """Return the catalog song resource with the given number."""
+    return {
+        "id": str(1_000_000 + i),
+        "type": "songs",
+        "attributes": {
+            "name": f"Song {i}",
+            "artistName": f"Artist {i % ARTIST_COUNT}",
+            "albumName": f"Album {i // ALBUM_SIZE}",
+            "isrc": f"SYN{i:09d}",
+            "durationInMillis": 180_000 + i % 120_000,
+            "url": f"https://music.example.com/song/{i}",
+            "playParams": {"id": str(1_000_000 + i), "kind": "song"},
+            # Attributes the importer does not use, left out by field selection
+            "artwork": {
+                "width": 3000,
+                "height": 3000,
+                "url": f"https://art.example.com/{i}/{{w}}x{{h}}bb.jpg",
+                "bgColor": "1b1b1b",
+                "textColor1": "ffffff",
+                "textColor2": "e6e6e6",
+            },
+            "composerName": f"Composer {i % 97}",
+            "discNumber": 1,
+            "genreNames": ["Pop", "Music"],
+            "hasLyrics": True,
+            "previews": [{"url": f"https://audio.example.com/{i}.m4a"}],
+            "releaseDate": "2020-01-01",
+            "trackNumber": i % ALBUM_SIZE + 1,
+        },
+    }
+
+
+def make_album(i: int) -> dict:
+    """Return the catalog album resource of the song with the given number."""
+    number = i // ALBUM_SIZE
+    return {
+        "id": str(2_000_000 + number),
+        "type": "albums",
+        "attributes": {
+            "name": f"Album {number}",
+            "artistName": f"Artist {i % ARTIST_COUNT}",
+            "artistUrl": f"https://music.example.com/artist/{i % ARTIST_COUNT}",
+            "releaseDate": "2020-01-01",
+            "url": f"https://music.example.com/album/{number}",
+            "playParams": {"id": str(2_000_000 + number), "kind": "album"},
+        },
+    }
+
+
+def make_artist(i: int) -> dict:
+    """Return the catalog artist resource of the song with the given number."""
+    number = i % ARTIST_COUNT
+    return {
+        "id": str(3_000_000 + number),
+        "type": "artists",
+        "attributes": {
+            "name": f"Artist {number}",
+            "url": f"https://music.example.com/artist/{number}",
+        },
+    }
+
+
+class SyntheticCatalog:
+    """A catalog of songs numbered 0..size-1, searchable by their title."""
+
+    def __init__(self, size: int):
+        self.size = size
+
+    def search_numbers(self, term: str, limit: int) -> list:
+        """Return the numbers of the songs found for a search term."""
+        numbers = [int(n) for n in _SONG_NUMBER.findall(term.lower())]
+        return [n for n in numbers if n < self.size][:limit]
+
+    def search(self, term: str, limit: int) -> list:
+        return [make_song(n) for n in self.search_numbers(term, limit)]
+
+    def get_by_isrc(self, isrc: str):
+        if not isrc.startswith("SYN"):
+            return None
+        number = int(isrc[3:])
+        return make_song(number) if number < self.size else None
+
+
+def _syncsafe(n: int) -> bytes:
+    return bytes([(n >> 21) & 0x7F, (n >> 14) & 0x7F, (n >> 7) & 0x7F, n & 0x7F])
+
+
+def _text_frame(frame_id: bytes, text: str) -> bytes:
+    body = b"\x03" + text.encode("utf-8")
+    return frame_id + len(body).to_bytes(4, "big") + b"\x00\x00" + body
+
+
+def write_mp3(path: str, title: str, artist: str, album: str, audio_size=4096):
+    """Write a file with an ID3v2.3 tag followed by fake MPEG frame data."""
+    frames = (
+        _text_frame(b"TIT2", title)
+        + _text_frame(b"TPE1", artist)
+        + _text_frame(b"TALB", album)
+    )
+    tag = b"ID3\x03\x00\x00" + _syncsafe(len(frames)) + frames
+    audio = (b"\xff\xfb\x90\x00" + os.urandom(412)) * (audio_size // 416 + 1)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as file:
+        file.write(tag + audio[:audio_size])
+
+
+def generate_mp3_tree(root: str, count: int, miss_ratio=0.1, seed=0) -> None:
+    """
+    Generate `count` tagged MP3 files laid out as Artist/Album/NN Title.mp3.
+
+    About `miss_ratio` of the files carry titles that are not in the
+    synthetic catalog, so they exercise every fallback query.
+    """
+    rng = random.Random(seed)
+    for i in range(count):
+        artist = f"Artist {i % ARTIST_COUNT}"
+        album = f"Album {i // ALBUM_SIZE}"
+        title = f"Song {i}" if rng.random() >= miss_ratio else f"Unknown Track {i}"
+        path = os.path.join(root, artist, album, f"{i % ALBUM_SIZE:02d} {title}.mp3")
+        write_mp3(path, title, artist, album)
+
+
+class StubSpotifyClient:
+    """Stands in for spotipy.Spotify, serving a synthetic playlist."""
+
+    def __init__(self, count: int, isrc_ratio=0.8, miss_ratio=0.1, seed=0):
+        rng = random.Random(seed)
+        self.items = []
+        for i in range(count):
+            known = rng.random() >= miss_ratio
+            title = f"Song {i}" if known else f"Unknown Track {i}"
+            isrc = f"SYN{i:09d}" if rng.random() < isrc_ratio else f"ZZZ{i:09d}"
+            self.items.append(
+                {
+                    "added_at": f"2020-01-01T00:00:00.{i:06d}Z",
+                    "track": {
+                        "id": f"sp{i}",
+                        "name": title,
+                        "artists": [{"name": f"Artist {i % ARTIST_COUNT}"}],
+                        "album": {"name": f"Album {i // ALBUM_SIZE}"},
+                        "external_urls": {"spotify": f"https://open.example.com/{i}"},
+                        "external_ids": {"isrc": isrc},
+                        "duration_ms": 180_000 + i % 120_000,
+                    },
+                }
+            )
+        self.requests = 0
+
+    def _page(self, items, limit, offset):
+        self.requests += 1
+        return {
+            "items": items[offset : offset + limit],
+            "total": len(items),
+            "limit": limit,
+            "next": "next" if offset + limit < len(items) else None,
+        }
+
+    def playlist(self, playlist_id, fields=None):
+        self.requests += 1
+        return {"snapshot_id": f"snapshot-{len(self.items)}"}
+
+    def playlist_tracks(self, playlist_id, fields=None, limit=100, offset=0, **kwargs):
+        return self._page(self.items, limit, offset)
+
+    def current_user_saved_tracks(self, limit=20, offset=0, **kwargs):
+        return self._page(self.items[::-1], limit, offset)